@@ -0,0 +1,164 @@
+import asyncio, contextvars, functools
+import database, metrics
+from tally import VoteTally
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
+
+class Shard:
+    # One office's store with its own threads, so a slow report or ingest in one
+    # office never queues in front of another office's votes.
+    def __init__(self, name:str, store:database.Store):
+        self.name = name
+        self.store = store
+        # Writes queue on one thread in front of the single writer connection, reads
+        # spread over the reader pool so they never wait behind a commit.
+        self.writerExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-writer")
+        self.readerExecutor = ThreadPoolExecutor(max_workers=database.ReaderPoolSize, thread_name_prefix=f"{name}-reader")
+        # Slow maintenance work such as history ingestion gets its own thread.
+        self.backgroundExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-background")
+        self.voteBatcher = VoteBatcher()
+        self.liveTally = VoteTally()
+        self.tallyLock = asyncio.Lock()
+
+async def run(executor, function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context so queries are attributed to the update being handled.
+    context = contextvars.copy_context()
+    context.run(database.activeStore.set, shard().store)
+    call = functools.partial(metrics.timed(function.__name__, function), *args, **kwargs)
+    return await loop.run_in_executor(executor, context.run, call)
+
+async def read(function, *args, **kwargs):
+    return await run(shard().readerExecutor, function, *args, **kwargs)
+
+async def write(function, *args, **kwargs):
+    return await run(shard().writerExecutor, function, *args, **kwargs)
+
+async def background(function, *args, **kwargs):
+    return await run(shard().backgroundExecutor, function, *args, **kwargs)
+
+async def createDraft(menuDate:date):
+    return await write(database.createDraft, menuDate)
+
+async def preview() -> List[database.MenuRow]:
+    return await read(database.preview)
+
+async def publish():
+    return await write(database.publish)
+
+async def closeOrder():
+    return await write(database.closeOrder)
+
+async def status() -> List[database.OptionTally]:
+    return await read(database.status)
+
+async def report() -> List[database.OptionTally]:
+    return await read(database.report)
+
+async def addMenuOptions(descriptions:List[str]) -> Optional[Tuple[int, List[database.MenuRow]]]:
+    return await write(database.addMenuOptions, descriptions)
+
+async def getNextDate() -> Optional[date]:
+    return await read(database.getNextDate)
+
+async def getCurrentDate() -> Optional[date]:
+    return await read(database.getCurrentDate)
+
+async def getNextMenu() -> Tuple[Optional[int], Optional[date], List[database.MenuRow]]:
+    return await read(database.getNextMenu)
+
+async def pendingMembers(limit:int) -> List[database.Member]:
+    return await read(database.pendingMembers, limit)
+
+async def requestMembership(idOfUser:int, chatId:int, firstName:str, lastName:str) -> database.Member:
+    return await write(database.requestMembership, idOfUser, chatId, firstName, lastName)
+
+async def decideMembers(ids:List[int], status:str) -> List[database.Member]:
+    return await write(database.decideMembers, ids, status)
+
+async def revokeMembers(ids:List[int]) -> List[database.Member]:
+    return await write(database.revokeMembers, ids)
+
+async def unvotedChatIds() -> List[int]:
+    return await read(database.unvotedChatIds)
+
+async def enqueueBroadcast(message:str, chatIds:List[int]) -> database.BroadcastProgress:
+    return await write(database.enqueueBroadcast, message, chatIds)
+
+async def broadcastProgress(limit:int) -> List[database.BroadcastProgress]:
+    return await read(database.broadcastProgress, limit)
+
+class VoteBatcher:
+    def __init__(self, delay:float = 0.005, maxBatch:int = 500):
+        self.delay = delay
+        self.maxBatch = maxBatch
+        self.pending = []
+        self.flushTask = None
+
+    async def submit(self, idOfUser:int, idOfChoice:Optional[int], generationId:int) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(((idOfUser, idOfChoice, generationId), future))
+        if not self.flushTask:
+            self.flushTask = asyncio.create_task(self.flush())
+        return await future
+
+    async def flush(self):
+        try:
+            await asyncio.sleep(self.delay)
+            while self.pending:
+                batch, self.pending = self.pending[:self.maxBatch], self.pending[self.maxBatch:]
+                try:
+                    results = await write(database.saveVotes, [vote for vote, _ in batch])
+                except Exception as error:
+                    results = [error] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            self.flushTask = None
+
+defaultShard = Shard("database", database.store)
+activeShard: contextvars.ContextVar[Shard] = contextvars.ContextVar("activeShard", default=defaultShard)
+
+def shard() -> Shard:
+    return activeShard.get()
+
+async def updateUserChoice(idOfUser:int, idOfChoice:Optional[int], generationId:int) -> bool:
+    current = shard()
+    # Resolves only after the batch holding this vote has been committed.
+    accepted = await current.voteBatcher.submit(idOfUser, idOfChoice, generationId)
+    if accepted:
+        current.liveTally.record(generationId, idOfUser, idOfChoice)
+    return accepted
+
+async def refreshTally():
+    current = shard()
+    async with current.tallyLock:
+        current.liveTally.startRebuild()
+        try:
+            generation, rows = await read(database.nextStatus)
+        except Exception:
+            current.liveTally.rebuild(None, [])
+            raise
+        current.liveTally.rebuild(generation, rows)
+
+async def getUserChoice(idOfUser:int) -> database.UserChoices:
+    return await read(database.getUserChoice, idOfUser)
+
+async def shutdown():
+    current = shard()
+    if current.voteBatcher.flushTask:
+        await current.voteBatcher.flushTask
+    loop = asyncio.get_running_loop()
+    for executor in (current.readerExecutor, current.writerExecutor, current.backgroundExecutor):
+        await loop.run_in_executor(None, executor.shutdown)
+    current.store.close()
@@ -0,0 +1,534 @@
+import argparse, asyncio, json, os, random, statistics, tempfile, time, tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import (
+    date,
+    datetime,
+    timedelta
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import (
+    col,
+    select
+)
+from telegram import (
+    Bot,
+    CallbackQuery,
+    Chat,
+    Message,
+    MessageEntity,
+    Update,
+    User
+)
+from telegram.error import RetryAfter
+from telegram.ext import Application
+from broadcast import Broadcaster
+from outbox import Outbox
+from persistence import SqlitePersistence
+
+FirstUserId = 10_000_000
+
+class FakeBot(Bot):
+    def __init__(self, latency: float = 0.05, floodRate: float = 0.0, retryAfter: int = 1):
+        super().__init__(token="0:benchmark")
+        # Bot freezes its attributes once constructed.
+        with self._unfrozen():
+            self.latency = latency
+            self.floodRate = floodRate
+            self.retryAfter = retryAfter
+            self.sent = []
+            self.edited = []
+
+    async def get_me(self, *args, **kwargs) -> User:
+        self._bot_user = User(id=0, first_name="FakeBot", is_bot=True, username="fake_bot")
+        return self._bot_user
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.floodRate:
+            raise RetryAfter(self.retryAfter)
+        self.sent.append((chat_id, text))
+        return Message(message_id=len(self.sent), date=datetime.now(), chat=Chat(id=chat_id, type="private"), text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.edited.append((chat_id, message_id, text))
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return True
+
+async def sequentialBroadcast(bot: FakeBot, chatIds, text: str) -> float:
+    started = time.monotonic()
+    for chatId in chatIds:
+        await bot.send_message(chat_id=chatId, text=text)
+    return time.monotonic() - started
+
+async def benchBroadcast(args) -> None:
+    chatIds = list(range(args.users))
+    bot = FakeBot(latency=args.latency)
+    elapsed = await sequentialBroadcast(bot, chatIds, "benchmark")
+    print(f"sequential: {len(bot.sent)} sent in {elapsed:.2f}s")
+    bot = FakeBot(latency=args.latency, floodRate=args.flood_rate)
+    broadcaster = Broadcaster(bot, concurrency=args.concurrency, globalRate=args.rate)
+    summary = await broadcaster.broadcast(chatIds, "benchmark")
+    print(f"broadcaster: {summary.sent} sent, {summary.failed} failed, {summary.retried} retried in {summary.elapsed:.2f}s")
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+@contextmanager
+def countingQueries():
+    counter = QueryCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, "before_cursor_execute", counter)
+
+@contextmanager
+def scratchDirectory():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+def seedMenus(db, userIds, optionCount: int) -> None:
+    for offset in (1, 2):
+        db.createDraft(menuDate=date.today() + timedelta(days=offset))
+        db.addMenuOptions([f"Dish {index + 1}" for index in range(optionCount)])
+        db.publish()
+        generation, _, options = db.getNextMenu()
+        for userId in userIds:
+            db.updateUserChoice(idOfUser=userId, idOfChoice=random.choice(options).id, generationId=generation)
+        if offset == 1:
+            db.closeOrder()
+
+def legacyGetUserChoice(db, idOfUser: int):
+    result = []
+    for stage in ("current", "next"):
+        choice = None
+        with db.store.readSession() as session:
+            generation = db.stageGeneration(session, stage)
+            menuDate = session.exec(select(db.MenuGeneration).where(col(db.MenuGeneration.id) == generation)).first()
+            choiceId = session.exec(
+                select(db.UserChoice.choiceKey)
+                .where(col(db.UserChoice.generationId) == generation)
+                .where(col(db.UserChoice.userid) == idOfUser)
+            ).first()
+            if choiceId:
+                choice = session.exec(
+                    select(db.MenuOption).where(col(db.MenuOption.id) == choiceId)
+                ).first()
+        result += [menuDate, choice]
+    return result
+
+def measure(function, arguments):
+    latencies = []
+    with countingQueries() as counter:
+        for argument in arguments:
+            started = time.perf_counter()
+            function(argument)
+            latencies.append(time.perf_counter() - started)
+    return counter.count / len(arguments), latencies
+
+def printLatencies(name: str, queries: float, latencies) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name}: {queries:.1f} queries/call, mean {statistics.mean(latencies) * 1e3:.3f}ms, "
+          f"p50 {quantiles[49] * 1e3:.3f}ms, p99 {quantiles[98] * 1e3:.3f}ms")
+
+async def benchMine(args) -> None:
+    with scratchDirectory():
+        import database as db
+        userIds = list(range(1, args.users + 1))
+        seedMenus(db, userIds, args.options)
+        calls = [random.choice(userIds) for _ in range(args.calls)]
+        legacyGetUserChoice(db, calls[0])
+        printLatencies("per-stage lookups", *measure(lambda userId: legacyGetUserChoice(db, userId), calls))
+        printLatencies("getUserChoice", *measure(lambda userId: db.getUserChoice(idOfUser=userId), calls))
+        db.store.close()
+
+async def benchVotes(args) -> None:
+    with scratchDirectory():
+        import asyncdb, database as db
+        seedMenus(db, [], args.options)
+        generation, _, options = db.getNextMenu()
+        votes = [(userId, random.choice(options).id, generation) for userId in range(1, args.users + 1)]
+        started = time.perf_counter()
+        for vote in votes:
+            db.updateUserChoice(*vote)
+        print(f"one commit per vote: {args.users / (time.perf_counter() - started):.0f} votes/s")
+        started = time.perf_counter()
+        await asyncio.gather(*[asyncdb.updateUserChoice(*vote) for vote in votes])
+        print(f"group commit: {args.users / (time.perf_counter() - started):.0f} votes/s")
+        db.store.close()
+
+async def benchReminders(args) -> None:
+    with scratchDirectory():
+        import database as db
+        users = [{"id": userId, "firstName": "User", "chatid": userId} for userId in range(1, args.users + 1)]
+        db.importMembers(users[0], users)
+        seedMenus(db, [user["id"] for user in users[:int(args.users * args.voted)]], args.options)
+
+        def perUser(_):
+            return [member.chatId for member in db.approvedMembers() if not db.getUserChoice(member.id)[3]]
+
+        printLatencies("per-user lookups", *measure(perUser, range(3)))
+        queries, latencies = measure(lambda _: db.unvotedChatIds(), range(args.calls))
+        printLatencies("unvotedChatIds", queries, latencies)
+        chatIds = db.unvotedChatIds()
+        bot = FakeBot(latency=args.latency)
+        summary = await Broadcaster(bot, concurrency=args.concurrency, globalRate=args.rate).broadcast(chatIds, "reminder")
+        print(f"reminded {summary.sent} of {args.users} users in {summary.elapsed:.2f}s")
+        db.store.close()
+
+def profileCalls(name: str, function, calls: int) -> None:
+    function()
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    elapsed = (time.perf_counter() - started) / calls
+    # Traced separately, tracing slows every allocation down.
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    print(f"{name}: {elapsed * 1e3:.3f}ms/call, peak {peak / 1024:.0f} KiB, {blocks} blocks held by the result")
+    del result
+
+async def benchStatus(args) -> None:
+    with scratchDirectory():
+        generateUsers(args.users)
+        import asyncdb, database as db, lunchbot, offices
+        offices.load()
+        userIds = [FirstUserId + index for index in range(args.users)]
+        for offset in (1, 2, 3):
+            db.createDraft(menuDate=date.today() + timedelta(days=offset))
+            db.addMenuOptions([f"Dish {index + 1}" for index in range(args.options)])
+            if offset == 3:
+                break
+            db.publish()
+            generation, _, options = db.getNextMenu()
+            db.saveVotes([(userId, random.choice(options).id, generation) for userId in userIds])
+            if offset == 1:
+                db.closeOrder()
+        await asyncdb.refreshTally()
+        liveTally = asyncdb.shard().liveTally
+        header = (await offices.current().menuCache.get()).header
+        profileCalls("/status from the live tally", lambda: (lunchbot.generateList(liveTally.rows()), header), args.calls)
+        profileCalls("/status from the database", lambda: (db.status(), lunchbot.generateList(db.status())), args.calls)
+        profileCalls("/report", lambda: (db.report(), lunchbot.generateList(db.report())), args.calls)
+        profileCalls("getNextMenu", db.getNextMenu, args.calls)
+        profileCalls("preview", db.preview, args.calls)
+        profileCalls("getUserChoice", lambda: db.getUserChoice(random.choice(userIds)), args.calls)
+        await asyncdb.shutdown()
+
+def generateUsers(count: int, path: str = "users.json", firstUserId: int = FirstUserId) -> None:
+    users = [
+        {"id": firstUserId + index, "firstName": f"User{index}", "lastName": "Synthetic", "chatid": firstUserId + index}
+        for index in range(count)
+    ]
+    with open(path, "w") as file:
+        json.dump({"admin": users[0], "users": users}, file)
+
+class UpdateFactory:
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
+        self.updateId = 0
+
+    def __call__(self, userId: int, text: str) -> Update:
+        self.updateId += 1
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))] if text.startswith("/") else None
+        message = Message(
+            message_id=self.updateId, date=datetime.now(), text=text, entities=entities,
+            chat=Chat(id=userId, type=Chat.PRIVATE),
+            from_user=User(id=userId, first_name="Synthetic", is_bot=False)
+        )
+        message.set_bot(self.bot)
+        return Update(update_id=self.updateId, message=message)
+
+    def press(self, userId: int, data: str) -> Update:
+        self.updateId += 1
+        message = Message(message_id=self.updateId, date=datetime.now(), text="menu", chat=Chat(id=userId, type=Chat.PRIVATE))
+        user = User(id=userId, first_name="Synthetic", is_bot=False)
+        query = CallbackQuery(id=str(self.updateId), from_user=user, chat_instance=str(userId), data=data, message=message)
+        message.set_bot(self.bot)
+        query.set_bot(self.bot)
+        return Update(update_id=self.updateId, callback_query=query)
+
+def voteData(menu) -> str:
+    return f"v:{menu.generation}:{random.choice(menu.options).id}"
+
+class LoadRecorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = 0
+
+    async def onError(self, update, context) -> None:
+        self.errors += 1
+
+    async def send(self, application: Application, update: Update, phase: str) -> None:
+        started = time.perf_counter()
+        await application.process_update(update)
+        self.latencies[phase].append(time.perf_counter() - started)
+
+    def report(self, phase: str, elapsed: float) -> None:
+        latencies = self.latencies[phase]
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        print(f"{phase}: {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), "
+              f"p50 {quantiles[49] * 1e3:.1f}ms, p95 {quantiles[94] * 1e3:.1f}ms, p99 {quantiles[98] * 1e3:.1f}ms")
+
+async def runPhase(recorder: LoadRecorder, phases, sessions) -> None:
+    started = time.perf_counter()
+    await asyncio.gather(*sessions)
+    for phase in phases:
+        recorder.report(phase, time.perf_counter() - started)
+
+async def benchLoad(args) -> None:
+    with scratchDirectory():
+        generateUsers(args.users)
+        import database as db, lunchbot, offices
+        bot = FakeBot(latency=args.latency, floodRate=args.flood_rate)
+        lunchbot.bot = bot
+        lunchbot.broadcaster = Broadcaster(bot, concurrency=args.concurrency, globalRate=args.rate)
+        lunchbot.outbox = Outbox(lunchbot.broadcaster)
+        offices.load()
+        application = Application.builder().bot(bot).persistence(SqlitePersistence()).build()
+        makeUpdate, recorder = UpdateFactory(bot), LoadRecorder()
+        lunchbot.registerHandlers(application)
+        application.add_error_handler(recorder.onError)
+        await application.initialize()
+        adminId, userIds = FirstUserId, [FirstUserId + index for index in range(args.users)]
+        db.createDraft(menuDate=date.today() + timedelta(days=1))
+        db.addMenuOptions([f"Dish {index + 1}" for index in range(args.options)])
+
+        async def publish():
+            await recorder.send(application, makeUpdate(adminId, "/publish"), "publish")
+            await recorder.send(application, makeUpdate(adminId, "Yes"), "publish")
+
+        async def vote(userId: int):
+            await recorder.send(application, makeUpdate(userId, "/options"), "options")
+            await recorder.send(application, makeUpdate.press(userId, voteData(await offices.current().menuCache.get())), "vote")
+
+        async def mine(userId: int):
+            await recorder.send(application, makeUpdate(userId, "/mine"), "mine")
+
+        async def status():
+            await recorder.send(application, makeUpdate(adminId, "/status"), "status")
+
+        await runPhase(recorder, ["publish"], [publish()])
+        await lunchbot.outbox.idle()
+        await runPhase(recorder, ["options", "vote"], [vote(userId) for userId in userIds])
+        await runPhase(recorder, ["mine"], [mine(userId) for userId in userIds])
+        await runPhase(recorder, ["status"], [status() for _ in range(args.status_calls)])
+        print(f"{len(bot.sent)} messages sent, {recorder.errors} updates failed")
+        await application.shutdown()
+        await lunchbot.outbox.stop()
+        db.store.close()
+
+async def benchOffices(args) -> None:
+    with scratchDirectory():
+        import config, database as db, lunchbot, offices
+        bigAdmin, smallAdmin = FirstUserId, FirstUserId + args.users
+        config.settings["offices"] = ["big", "small"]
+        for name, count, firstUserId in (("big", args.users, bigAdmin), ("small", args.small_users, smallAdmin)):
+            os.makedirs(os.path.join(config.settings["officesDirectory"], name))
+            generateUsers(count, os.path.join(config.settings["officesDirectory"], name, "users.json"), firstUserId)
+        bot = FakeBot(latency=0)
+        lunchbot.bot = bot
+        lunchbot.broadcaster = Broadcaster(bot, globalRate=100_000)
+        lunchbot.outbox = Outbox(lunchbot.broadcaster)
+        offices.load()
+        application = Application.builder().bot(bot).persistence(SqlitePersistence()).build()
+        makeUpdate, recorder = UpdateFactory(bot), LoadRecorder()
+        lunchbot.registerHandlers(application)
+        application.add_error_handler(recorder.onError)
+        await application.initialize()
+        for office in offices.offices.values():
+            with offices.using(office):
+                db.createDraft(menuDate=date.today() + timedelta(days=1))
+                db.addMenuOptions([f"Dish {index + 1}" for index in range(args.options)])
+
+        async def command(userId: int, phase: str, *texts: str):
+            for text in texts:
+                await recorder.send(application, makeUpdate(userId, text), phase)
+
+        async def vote(office, userId: int, phase: str):
+            await recorder.send(application, makeUpdate(userId, "/options"), phase)
+            with offices.using(office):
+                menu = await office.menuCache.get()
+            await recorder.send(application, makeUpdate.press(userId, voteData(menu)), phase)
+
+        smallUsers = [smallAdmin + index for index in range(args.small_users)]
+        await runPhase(recorder, ["publish"], [command(admin, "publish", "/publish", "Yes") for admin in (bigAdmin, smallAdmin)])
+        big, small = offices.offices["big"], offices.offices["small"]
+        await runPhase(recorder, ["big votes"], [vote(big, bigAdmin + index, "big votes") for index in range(args.users)])
+        await runPhase(recorder, ["small votes alone"], [vote(small, userId, "small votes alone") for userId in smallUsers])
+        await command(bigAdmin, "close", "/close", "Yes")
+        await runPhase(recorder, ["small votes during big reports", "big report"], [
+            *[command(bigAdmin, "big report", "/report") for _ in range(args.reports)],
+            *[vote(small, userId, "small votes during big reports") for userId in smallUsers],
+        ])
+        await lunchbot.outbox.stop()
+        print(f"{len(bot.sent)} messages sent, {recorder.errors} updates failed")
+        await application.shutdown()
+        for office in offices.offices.values():
+            office.shard.store.close()
+
+async def benchFlood(args) -> None:
+    with scratchDirectory():
+        generateUsers(args.users)
+        import database as db, lunchbot, metrics, offices
+        from throttle import FloodControl
+        bot = FakeBot(latency=args.latency)
+        lunchbot.bot = bot
+        lunchbot.broadcaster = Broadcaster(bot)
+        lunchbot.outbox = Outbox(lunchbot.broadcaster)
+        offices.load()
+        db.createDraft(menuDate=date.today() + timedelta(days=1))
+        db.addMenuOptions([f"Dish {index + 1}" for index in range(8)])
+        db.publish()
+        userIds = [FirstUserId + index for index in range(args.users)]
+        abusers, users = userIds[:args.abusers], userIds[args.abusers:]
+        for label, rate in (("no flood control", float("inf")), ("flood control", args.rate)):
+            processor = FloodControl(args.concurrency, rate, args.burst, 60)
+            application = Application.builder().bot(bot).persistence(SqlitePersistence()).concurrent_updates(processor).build()
+            makeUpdate, recorder = UpdateFactory(bot), LoadRecorder()
+            lunchbot.registerHandlers(application)
+            await application.initialize()
+
+            async def send(userId: int, text: str, phase: str):
+                update = makeUpdate(userId, text)
+                started = time.perf_counter()
+                await processor.process_update(update, application.process_update(update))
+                recorder.latencies[phase].append(time.perf_counter() - started)
+
+            async def hammer(userId: int):
+                await asyncio.gather(*[send(userId, "/mine", "abuser /mine") for _ in range(args.spam)])
+
+            async def behave(userId: int):
+                await asyncio.sleep(random.random() * 0.2)
+                await send(userId, "/mine", "user /mine")
+
+            print(label)
+            metrics.counters.clear()
+            await runPhase(recorder, ["user /mine", "abuser /mine"], [*map(hammer, abusers), *map(behave, users)])
+            throttled = sum(value for (name, _), value in metrics.counters.items() if name == "throttled_updates_total")
+            print(f"throttled {throttled:g} of {args.abusers * args.spam + len(users)} updates")
+            await application.shutdown()
+        db.store.close()
+
+async def benchOutbox(args) -> None:
+    with scratchDirectory():
+        import asyncdb, database as db
+        bot = FakeBot(latency=args.latency)
+        chatIds = list(range(args.users))
+        outbox = Outbox(Broadcaster(bot, concurrency=args.concurrency, globalRate=args.rate))
+        broadcastId = (await outbox.enqueue(chatIds, "benchmark")).id
+        await asyncio.sleep(args.crash_after)
+        # Cancelling the drain mid batch leaves the database as a killed process would.
+        tasks = list(outbox.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        beforeCrash = len(bot.sent)
+        outbox = Outbox(Broadcaster(bot, concurrency=args.concurrency, globalRate=args.rate))
+        resumed = await outbox.resume()
+        await outbox.idle()
+        delivered = [chatId for chatId, _ in bot.sent]
+        progress = db.broadcastProgress(1)[0]
+        print(f"sent {beforeCrash} before the crash, resumed broadcasts {resumed}, {len(delivered)} sent in total")
+        print(f"broadcast {broadcastId}: {progress.sent} sent, {progress.unknown} unknown, {progress.pending} pending, "
+              f"{len(set(delivered))} chats reached, {len(delivered) - len(set(delivered))} duplicates")
+        await asyncdb.shutdown()
+
+async def benchUsers(args) -> None:
+    generateUsers(args.users, args.output)
+    print(f"wrote {args.users} users to {args.output}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LunchBot benchmarks against a fake Telegram bot")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    broadcastParser = subparsers.add_parser("broadcast", help="announce() throughput")
+    broadcastParser.add_argument("--users", type=int, default=200)
+    broadcastParser.add_argument("--latency", type=float, default=0.05)
+    broadcastParser.add_argument("--flood-rate", type=float, default=0.0)
+    broadcastParser.add_argument("--concurrency", type=int, default=16)
+    broadcastParser.add_argument("--rate", type=float, default=30)
+    broadcastParser.set_defaults(run=benchBroadcast)
+    mineParser = subparsers.add_parser("mine", help="/mine lookups per call")
+    mineParser.add_argument("--users", type=int, default=500)
+    mineParser.add_argument("--options", type=int, default=10)
+    mineParser.add_argument("--calls", type=int, default=2000)
+    mineParser.set_defaults(run=benchMine)
+    votesParser = subparsers.add_parser("votes", help="vote write throughput during a spike")
+    votesParser.add_argument("--users", type=int, default=2000)
+    votesParser.add_argument("--options", type=int, default=10)
+    votesParser.set_defaults(run=benchVotes)
+    remindersParser = subparsers.add_parser("reminders", help="find and remind users who have not voted")
+    remindersParser.add_argument("--users", type=int, default=5000)
+    remindersParser.add_argument("--voted", type=float, default=0.7)
+    remindersParser.add_argument("--options", type=int, default=10)
+    remindersParser.add_argument("--calls", type=int, default=50)
+    remindersParser.add_argument("--latency", type=float, default=0.05)
+    remindersParser.add_argument("--concurrency", type=int, default=16)
+    remindersParser.add_argument("--rate", type=float, default=30)
+    remindersParser.set_defaults(run=benchReminders)
+    loadParser = subparsers.add_parser("load", help="drive the real handlers with many simulated users")
+    loadParser.add_argument("--users", type=int, default=2000)
+    loadParser.add_argument("--options", type=int, default=8)
+    loadParser.add_argument("--latency", type=float, default=0.02)
+    loadParser.add_argument("--flood-rate", type=float, default=0.0)
+    loadParser.add_argument("--concurrency", type=int, default=16)
+    loadParser.add_argument("--rate", type=float, default=1000)
+    loadParser.add_argument("--status-calls", type=int, default=20)
+    loadParser.set_defaults(run=benchLoad)
+    officesParser = subparsers.add_parser("offices", help="votes in a small office while a big one runs reports")
+    officesParser.add_argument("--users", type=int, default=5000)
+    officesParser.add_argument("--small-users", type=int, default=200)
+    officesParser.add_argument("--options", type=int, default=8)
+    officesParser.add_argument("--reports", type=int, default=50)
+    officesParser.set_defaults(run=benchOffices)
+    floodParser = subparsers.add_parser("flood", help="latency for normal users while a few accounts spam")
+    floodParser.add_argument("--users", type=int, default=500)
+    floodParser.add_argument("--abusers", type=int, default=5)
+    floodParser.add_argument("--spam", type=int, default=400)
+    floodParser.add_argument("--latency", type=float, default=0.02)
+    floodParser.add_argument("--concurrency", type=int, default=32)
+    floodParser.add_argument("--rate", type=float, default=1.0)
+    floodParser.add_argument("--burst", type=float, default=10)
+    floodParser.set_defaults(run=benchFlood)
+    statusParser = subparsers.add_parser("status", help="time and memory per /status and menu read on a large roster")
+    statusParser.add_argument("--users", type=int, default=5000)
+    statusParser.add_argument("--options", type=int, default=10)
+    statusParser.add_argument("--calls", type=int, default=200)
+    statusParser.set_defaults(run=benchStatus)
+    outboxParser = subparsers.add_parser("outbox", help="resume a broadcast after a simulated crash")
+    outboxParser.add_argument("--users", type=int, default=2000)
+    outboxParser.add_argument("--latency", type=float, default=0.02)
+    outboxParser.add_argument("--concurrency", type=int, default=16)
+    outboxParser.add_argument("--rate", type=float, default=500)
+    outboxParser.add_argument("--crash-after", type=float, default=1.0)
+    outboxParser.set_defaults(run=benchOutbox)
+    usersParser = subparsers.add_parser("users", help="write a synthetic users.json")
+    usersParser.add_argument("--users", type=int, default=5000)
+    usersParser.add_argument("--output", default="users.json")
+    usersParser.set_defaults(run=benchUsers)
+    args = parser.parse_args()
+    asyncio.run(args.run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio, logging, time
+from dataclasses import (
+    dataclass,
+    field
+)
+from datetime import timedelta
+from typing import (
+    Dict,
+    Iterable,
+    List
+)
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter
+)
+
+# Telegram allows roughly 30 messages per second overall and one per second per chat.
+GlobalRate = 30
+ChatRate = 1
+Concurrency = 16
+MaxRetries = 3
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def tryAcquire(self) -> bool:
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(max(self.updated - time.monotonic(), 0) + (1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+@dataclass
+class DeliverySummary:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+    failedChats: List[int] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed
+
+def retryDelay(error: RetryAfter) -> float:
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+class Broadcaster:
+    def __init__(self, bot, concurrency: int = Concurrency, globalRate: float = GlobalRate,
+                 chatRate: float = ChatRate, maxRetries: int = MaxRetries):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.chatRate = chatRate
+        self.maxRetries = maxRetries
+        self.globalBucket = TokenBucket(globalRate, globalRate)
+        self.chatBuckets: Dict[int, TokenBucket] = {}
+
+    def chatBucket(self, chatId: int) -> TokenBucket:
+        bucket = self.chatBuckets.get(chatId)
+        if not bucket:
+            bucket = self.chatBuckets[chatId] = TokenBucket(self.chatRate, 1)
+        return bucket
+
+    async def deliver(self, chatId: int, text: str, summary: DeliverySummary) -> None:
+        for attempt in range(self.maxRetries + 1):
+            await self.chatBucket(chatId).acquire()
+            await self.globalBucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chatId, text=text)
+                summary.sent += 1
+                return
+            except RetryAfter as error:
+                # Flood control applies to the whole bot, so every worker backs off.
+                self.globalBucket.pause(retryDelay(error))
+            except (Forbidden, BadRequest) as error:
+                logging.warning("broadcast to %s rejected: %s", chatId, error)
+                break
+            except NetworkError as error:
+                logging.warning("broadcast to %s failed: %s", chatId, error)
+                if attempt < self.maxRetries:
+                    await asyncio.sleep(2 ** attempt)
+            except Exception:
+                logging.exception("broadcast to %s crashed", chatId)
+                break
+            if attempt < self.maxRetries:
+                summary.retried += 1
+        summary.failed += 1
+        summary.failedChats.append(chatId)
+
+    def pruneChatBuckets(self) -> None:
+        for chatId, bucket in list(self.chatBuckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.chatBuckets[chatId]
+
+    async def broadcast(self, chatIds: Iterable[int], text: str) -> DeliverySummary:
+        self.pruneChatBuckets()
+        summary = DeliverySummary()
+        started = time.monotonic()
+        pending = iter(chatIds)
+
+        async def worker() -> None:
+            for chatId in pending:
+                await self.deliver(chatId, text, summary)
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        summary.elapsed = time.monotonic() - started
+        return summary
@@ -0,0 +1,58 @@
+import json, os, re
+
+ConfigPath = "config.json"
+Defaults = {
+    "historyRetentionDays": 730,
+    "deleteIngestedArchives": False,
+    "metricsHost": "127.0.0.1",
+    "metricsPort": None,
+    "mode": "polling",
+    "concurrentUpdates": 32,
+    "floodRate": 1.0,
+    "floodBurst": 10,
+    "registerInterval": 60,
+    "webhookListen": "0.0.0.0",
+    "webhookPort": 8443,
+    "webhookPath": "lunchbot",
+    "webhookUrl": None,
+    "webhookSecret": None,
+    "webhookMaxConnections": 40,
+    "offices": [],
+    "officesDirectory": "offices",
+    "publishTimes": {},
+    "closeTimes": {},
+    "reminderMinutes": 30,
+    "timezone": None,
+    "broadcastRetentionDays": 30,
+}
+
+# The job queue numbers weekdays from Sunday.
+Weekdays = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+DayNames = ("sunday", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday")
+ClockTime = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+def weekdayTimes(times: dict, key: str) -> dict:
+    # Accepts "mon", "Mon" or "monday"; keys end up as the short lower case name.
+    normalised = {}
+    for day, at in times.items():
+        name = str(day).strip().lower()
+        if len(name) < 3 or not any(full.startswith(name) for full in DayNames):
+            raise ValueError(f"{key}: unknown weekday {day!r}, use one of {', '.join(Weekdays)}")
+        if not isinstance(at, str) or not ClockTime.match(at.strip()):
+            raise ValueError(f"{key}: time for {day!r} must look like 09:30, got {at!r}")
+        normalised[name[:3]] = at.strip()
+    return normalised
+
+def readConfig(path: str = ConfigPath) -> dict:
+    settings = dict(Defaults)
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            settings.update(json.load(file))
+    if settings["mode"] == "webhook" and not settings["webhookUrl"]:
+        # Without it the bot would register its listen address, e.g. https://0.0.0.0:8443, with Telegram.
+        raise ValueError(f"webhookUrl must be set in {path} when mode is webhook")
+    for key in ("publishTimes", "closeTimes"):
+        settings[key] = weekdayTimes(settings[key], key)
+    return settings
+
+settings = readConfig()
@@ -1,189 +1,569 @@
-import os
+import contextvars, os, threading
+from contextlib import contextmanager
 from datetime import (
     datetime,
-    date
+    date,
+    timezone
 )
 from typing import (
+    Iterator,
     List,
-    Optional
+    NamedTuple,
+    Optional,
+    Tuple
 )
 from sqlmodel import (
     Field,
-    Relationship,
     Session,
     SQLModel,
     col,
     create_engine,
-    select
+    delete,
+    select,
+    text,
+    update
 )
+from sqlalchemy import (
+    Index,
+    UniqueConstraint,
+    case,
+    event,
+    func
+)
+from sqlalchemy.dialects.sqlite import insert
+
+class MenuGeneration(SQLModel, table=True):
+	id: Optional[int] = Field(default=None, primary_key=True)
+	date: date
+	createdAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class Stage(SQLModel, table=True):
+	name: str = Field(primary_key=True)
+	generationId: Optional[int] = Field(default=None, foreign_key="menugeneration.id")
 
 class MenuOption(SQLModel, table=True):
 	id: Optional[int] = Field(default=None, primary_key=True)
+	generationId: int = Field(foreign_key="menugeneration.id", index=True)
+	position: int
 	description: str
-	users: List["UserChoice"] = Relationship(back_populates="choice")
 
 class UserChoice(SQLModel, table=True):
+	__table_args__ = (UniqueConstraint("generationId", "userid"),)
 	id: Optional[int] = Field(default=None, primary_key=True)
-	userid: int = Field(unique=True)
-	choiceKey: Optional[int] = Field(default=None, foreign_key="menuoption.id")
-	choice: Optional["MenuOption"] = Relationship(back_populates="users")
+	generationId: int = Field(foreign_key="menugeneration.id")
+	userid: int
+	choiceKey: Optional[int] = Field(default=None, foreign_key="menuoption.id", index=True)
+
+class Member(SQLModel, table=True):
+	id: int = Field(primary_key=True)
+	chatId: int
+	firstName: str
+	lastName: str = ""
+	status: str = Field(index=True)
+	isAdmin: bool = False
+	requestedAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class Date(SQLModel, table=True):
+class Broadcast(SQLModel, table=True):
 	id: Optional[int] = Field(default=None, primary_key=True)
-	date: date
+	text: str
+	total: int = 0
+	createdAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+	finishedAt: Optional[datetime] = Field(default=None, index=True)
+
+class Delivery(SQLModel, table=True):
+	__table_args__ = (Index("ix_delivery_broadcast_status", "broadcastId", "status"),)
+	broadcastId: int = Field(foreign_key="broadcast.id", primary_key=True)
+	chatId: int = Field(primary_key=True)
+	status: str = "pending"
+
+Stages = ("draft", "next", "current")
+DatabasePath = "lunchbot.db"
+ReaderPoolSize = 4
+ExportBatchSize = 500
+
+def configureConnection(dbapiConnection, connectionRecord):
+	cursor = dbapiConnection.cursor()
+	cursor.execute("PRAGMA journal_mode=WAL")
+	cursor.execute("PRAGMA synchronous=NORMAL")
+	cursor.execute("PRAGMA cache_size=-16000")
+	cursor.execute("PRAGMA temp_store=MEMORY")
+	cursor.execute("PRAGMA mmap_size=67108864")
+	cursor.execute("PRAGMA busy_timeout=5000")
+	cursor.close()
+
+def configureWriter(dbapiConnection, connectionRecord):
+	configureConnection(dbapiConnection, connectionRecord)
+	# Votes are group committed, so paying for a full fsync per batch is cheap.
+	dbapiConnection.execute("PRAGMA synchronous=FULL")
+
+def configureReader(dbapiConnection, connectionRecord):
+	configureConnection(dbapiConnection, connectionRecord)
+	dbapiConnection.execute("PRAGMA query_only=ON")
 
-draftEngine = None
-nextEngine = None
-currentEngine = None
+class Store:
+	def __init__(self, path:str):
+		self.path = path
+		self.reader = None
+		self.writer = None
+		self.writeLock = threading.Lock()
 
-def initializeDraftEngine():
-	global draftEngine
-	draftEngine = create_engine(f"sqlite:///draft.db")
-	SQLModel.metadata.create_all(draftEngine)
+	def open(self):
+		isNew = not os.path.exists(self.path)
+		self.writer = create_engine(f"sqlite:///{self.path}", pool_size=1, max_overflow=0)
+		event.listen(self.writer, "connect", configureWriter)
+		# Tables added since the file was created are picked up here as well.
+		SQLModel.metadata.create_all(self.writer)
+		if isNew:
+			with Session(self.writer) as session:
+				for stage in Stages:
+					session.add(Stage(name = stage))
+				session.commit()
+				for stage in Stages:
+					importLegacyStage(session, stage, os.path.dirname(self.path))
+		self.reader = create_engine(f"sqlite:///{self.path}", pool_size=ReaderPoolSize, max_overflow=0)
+		event.listen(self.reader, "connect", configureReader)
 
-def initializeNextEngine():
-	global nextEngine
-	nextEngine = create_engine(f"sqlite:///next.db")
-	SQLModel.metadata.create_all(nextEngine)
+	def close(self):
+		for engine in (self.reader, self.writer):
+			if engine:
+				engine.dispose()
+		self.reader, self.writer = None, None
 
-def initializeCurrentEngine():
-	global currentEngine
-	currentEngine = create_engine(f"sqlite:///current.db")
-	SQLModel.metadata.create_all(currentEngine)
+	def ensureOpen(self):
+		if not self.reader:
+			with self.writeLock:
+				if not self.reader:
+					self.open()
+
+	@contextmanager
+	def readSession(self):
+		self.ensureOpen()
+		with Session(self.reader) as session:
+			yield session
+
+	@contextmanager
+	def writeSession(self):
+		self.ensureOpen()
+		with self.writeLock:
+			with Session(self.writer, expire_on_commit=False) as session:
+				yield session
+
+store = Store(DatabasePath)
+# Each office has its own store; the async layer binds it for every call it runs.
+activeStore: contextvars.ContextVar[Store] = contextvars.ContextVar("activeStore", default=store)
+
+def currentStore() -> Store:
+	return activeStore.get()
+
+def importLegacyStage(session:Session, stage:str, directory:str):
+	# Menus from before generations lived in draft.db/next.db/current.db.
+	legacyPath = os.path.join(directory, f"{stage}.db")
+	if not os.path.exists(legacyPath):
+		return
+	session.exec(text("ATTACH DATABASE :path AS legacy").bindparams(path = legacyPath))
+	legacyDate = session.exec(text("SELECT date FROM legacy.date LIMIT 1")).first()
+	if legacyDate:
+		generation = MenuGeneration(date = date.fromisoformat(legacyDate[0]))
+		session.add(generation)
+		session.flush()
+		session.exec(text(
+			"INSERT INTO menuoption (generationId, position, description) "
+			"SELECT :generation, id, description FROM legacy.menuoption"
+		).bindparams(generation = generation.id))
+		session.exec(text(
+			"INSERT INTO userchoice (generationId, userid, choiceKey) "
+			"SELECT :generation, choice.userid, option.id FROM legacy.userchoice AS choice "
+			"LEFT JOIN menuoption AS option ON option.generationId = :generation AND option.position = choice.choiceKey"
+		).bindparams(generation = generation.id))
+		session.get(Stage, stage).generationId = generation.id
+	session.commit()
+	session.exec(text("DETACH DATABASE legacy"))
+	os.rename(src=legacyPath, dst=legacyPath + ".migrated")
+
+def stageGeneration(session:Session, stage:str) -> Optional[int]:
+	return session.exec(
+		select(Stage.generationId).where(col(Stage.name) == stage)
+	).first()
+
+def setStage(session:Session, stage:str, generationId:Optional[int]):
+	session.get(Stage, stage).generationId = generationId
 
 def createDraft(menuDate:date):
-	if os.path.exists("draft.db"):
-		os.remove("draft.db")
-	initializeDraftEngine()
-	with Session(draftEngine) as session:
-		session.add(Date(date = menuDate))
+	with currentStore().writeSession() as session:
+		oldDraft = stageGeneration(session, "draft")
+		generation = MenuGeneration(date = menuDate)
+		session.add(generation)
+		session.flush()
+		setStage(session, "draft", generation.id)
+		if oldDraft:
+			session.exec(delete(MenuOption).where(col(MenuOption.generationId) == oldDraft))
+			session.exec(delete(MenuGeneration).where(col(MenuGeneration.id) == oldDraft))
 		session.commit()
 
-def preview():
-	if not draftEngine:
-		initializeDraftEngine()
-	with Session(draftEngine) as session:
-		return session.exec(
-			select(MenuOption)
-		).all()
+class MenuRow(NamedTuple):
+	id: int
+	position: int
+	description: str
+
+def menuRows(session:Session, generationId:int) -> List[MenuRow]:
+	# Plain tuples from a column select skip the identity map and model validation.
+	return [
+		MenuRow(*row) for row in session.exec(
+			select(MenuOption.id, MenuOption.position, MenuOption.description)
+			.where(col(MenuOption.generationId) == generationId)
+			.order_by(col(MenuOption.position))
+		)
+	]
+
+def preview() -> List[MenuRow]:
+	with currentStore().readSession() as session:
+		return [
+			MenuRow(*row) for row in session.exec(
+				select(MenuOption.id, MenuOption.position, MenuOption.description)
+				.join(Stage, col(Stage.generationId) == col(MenuOption.generationId))
+				.where(col(Stage.name) == "draft")
+				.order_by(col(MenuOption.position))
+			)
+		]
 
 def publish():
-	global draftEngine
-	global nextEngine
-	draftEngine, nextEngine = None, None
-	if os.path.exists("next.db"):
-		os.rename(src="next.db", dst="next_" + datetime.now().strftime("%Y%m%d_%H.%M.%S.%f") + ".db")
-	if os.path.exists("draft.db"):
-		os.rename(src="draft.db", dst="next.db")
-	initializeNextEngine()
+	with currentStore().writeSession() as session:
+		setStage(session, "next", stageGeneration(session, "draft"))
+		setStage(session, "draft", None)
+		session.commit()
 
 def closeOrder():
-	global nextEngine
-	global currentEngine
-	nextEngine, currentEngine = None, None
-	if os.path.exists("current.db"):
-		os.rename(src="current.db", dst="current_" + datetime.now().strftime("%Y%m%d_%H.%M.%S.%f") + ".db")
-	if os.path.exists("next.db"):
-		os.rename(src="next.db", dst="current.db")
-	initializeCurrentEngine()
-
-def status():
-	if not nextEngine:
-		initializeNextEngine()
-	with Session(nextEngine) as session:
-		options = session.exec(
-			select(MenuOption)
-		).all()
-		return [{"option": option, "users": option.users} for option in options]
-
-def report():
-	if not currentEngine:
-		initializeCurrentEngine()
-	with Session(currentEngine) as session:
-		options = session.exec(
-			select(MenuOption)
+	with currentStore().writeSession() as session:
+		setStage(session, "current", stageGeneration(session, "next"))
+		setStage(session, "next", None)
+		session.commit()
+
+class OptionTally(NamedTuple):
+	id: int
+	description: str
+	total: int
+	userIds: List[int]
+
+def tally(session:Session, stage:str) -> List[OptionTally]:
+	rows = session.exec(
+		select(MenuOption.id, MenuOption.description, func.count(col(UserChoice.id)), func.group_concat(UserChoice.userid))
+		.join(Stage, col(Stage.generationId) == col(MenuOption.generationId))
+		.outerjoin(UserChoice, col(UserChoice.choiceKey) == col(MenuOption.id))
+		.where(col(Stage.name) == stage)
+		.group_by(col(MenuOption.id))
+		.order_by(col(MenuOption.position))
+	).all()
+	return [
+		OptionTally(id_, description, total, [int(userId) for userId in userIds.split(",")] if userIds else [])
+		for id_, description, total, userIds in rows
+	]
+
+def status() -> List[OptionTally]:
+	with currentStore().readSession() as session:
+		return tally(session, "next")
+
+def nextStatus() -> Tuple[Optional[int], List[OptionTally]]:
+	with currentStore().readSession() as session:
+		while True:
+			generation = stageGeneration(session, "next")
+			rows = tally(session, "next")
+			# Retry if a publish or close moved the pointer between the two reads.
+			if stageGeneration(session, "next") == generation:
+				return generation, rows
+
+def report() -> List[OptionTally]:
+	with currentStore().readSession() as session:
+		return tally(session, "current")
+
+def addMenuOptions(descriptions:List[str]) -> Optional[Tuple[int, List[MenuRow]]]:
+	with currentStore().writeSession() as session:
+		draft = stageGeneration(session, "draft")
+		if not draft:
+			return None
+		options = menuRows(session, draft)
+		known = {option.description.casefold() for option in options}
+		newDescriptions = []
+		for description in descriptions:
+			if description.casefold() not in known:
+				known.add(description.casefold())
+				newDescriptions.append(description)
+		lastPosition = options[-1].position if options else 0
+		newOptions = [
+			MenuOption(generationId = draft, position = lastPosition + index, description = description)
+			for index, description in enumerate(newDescriptions, start=1)
+		]
+		session.add_all(newOptions)
+		session.commit()
+		return len(newOptions), [*options, *[MenuRow(option.id, option.position, option.description) for option in newOptions]]
+
+def stageDate(stage:str) -> Optional[date]:
+	with currentStore().readSession() as session:
+		return session.exec(
+			select(MenuGeneration.date)
+			.join(Stage, col(Stage.generationId) == col(MenuGeneration.id))
+			.where(col(Stage.name) == stage)
+		).first()
+
+def getNextDate() -> Optional[date]:
+	return stageDate("next")
+
+def getCurrentDate() -> Optional[date]:
+	return stageDate("current")
+
+def getNextMenu() -> Tuple[Optional[int], Optional[date], List[MenuRow]]:
+	with currentStore().readSession() as session:
+		generation = session.exec(
+			select(MenuGeneration.id, MenuGeneration.date)
+			.join(Stage, col(Stage.generationId) == col(MenuGeneration.id))
+			.where(col(Stage.name) == "next")
+		).first()
+		if not generation:
+			return None, None, []
+		return generation[0], generation[1], menuRows(session, generation[0])
+
+def stageOrders(stage:str) -> Tuple[Optional[int], Optional[date], List[Tuple[int, Optional[str]]]]:
+	with currentStore().readSession() as session:
+		generation = session.exec(
+			select(MenuGeneration.id, MenuGeneration.date)
+			.join(Stage, col(Stage.generationId) == col(MenuGeneration.id))
+			.where(col(Stage.name) == stage)
+		).first()
+		if not generation:
+			return None, None, []
+		rows = session.exec(
+			select(UserChoice.userid, MenuOption.description)
+			.outerjoin(MenuOption, col(MenuOption.id) == col(UserChoice.choiceKey))
+			.where(col(UserChoice.generationId) == generation[0])
 		).all()
-		return [{"option": option, "users": option.users} for option in options]
-	
-
-def addMenuOption(description_:str):
-	with Session(draftEngine) as session:
-		session.add(
-			MenuOption(
-				description = description_
+		return generation[0], generation[1], rows
+
+def saveVotes(votes:List[Tuple[int, Optional[int], int]]) -> List[bool]:
+	with currentStore().writeSession() as session:
+		nextGeneration = stageGeneration(session, "next")
+		# Votes cast on a menu that has since been republished or closed are dropped.
+		accepted = [generationId == nextGeneration for _, _, generationId in votes]
+		rows = [
+			{"generationId": generationId, "userid": idOfUser, "choiceKey": idOfChoice}
+			for (idOfUser, idOfChoice, generationId), isAccepted in zip(votes, accepted) if isAccepted
+		]
+		if rows:
+			statement = insert(UserChoice)
+			session.execute(
+				statement.on_conflict_do_update(
+					index_elements=["generationId", "userid"],
+					set_={"choiceKey": statement.excluded.choiceKey}
+				),
+				rows
 			)
+			session.commit()
+		return accepted
+
+def updateUserChoice(idOfUser:int, idOfChoice:Optional[int], generationId:int) -> bool:
+	return saveVotes([(idOfUser, idOfChoice, generationId)])[0]
+
+class UserChoices(NamedTuple):
+	currentDate: Optional[date]
+	currentChoice: Optional[str]
+	nextDate: Optional[date]
+	nextChoice: Optional[str]
+
+def getUserChoice(idOfUser:int) -> UserChoices:
+	with currentStore().readSession() as session:
+		rows = session.exec(
+			select(Stage.name, MenuGeneration.date, MenuOption.description)
+			.join(MenuGeneration, col(MenuGeneration.id) == col(Stage.generationId))
+			.outerjoin(UserChoice, (col(UserChoice.generationId) == col(Stage.generationId)) & (col(UserChoice.userid) == idOfUser))
+			.outerjoin(MenuOption, col(MenuOption.id) == col(UserChoice.choiceKey))
+			.where(col(Stage.name).in_(["current", "next"]))
+		).all()
+	choices = {stage: (menuDate, description) for stage, menuDate, description in rows}
+	currentDate, currentChoice = choices.get("current", (None, None))
+	nextDate, nextChoice = choices.get("next", (None, None))
+	return UserChoices(currentDate, currentChoice, nextDate, nextChoice)
+
+def importMembers(admin:dict, users:List[dict]) -> int:
+	now = datetime.now(timezone.utc)
+	byId = {user["id"]: user for user in [admin, *users]}
+	rows = [
+		{
+			"id": user["id"], "chatId": user["chatid"], "firstName": user["firstName"], "lastName": user.get("lastName", ""),
+			"status": "approved", "isAdmin": user["id"] == admin["id"], "requestedAt": now
+		}
+		for user in byId.values()
+	]
+	with currentStore().writeSession() as session:
+		statement = insert(Member)
+		# Known members keep their status, so a seed entry cannot undo a /revoke; only the admin is reapproved.
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=["id"],
+				set_={
+					"status": case((statement.excluded.isAdmin, "approved"), else_=col(Member.status)),
+					"isAdmin": statement.excluded.isAdmin
+				}
+			),
+			rows
 		)
 		session.commit()
+	return len(rows)
 
-def getNextDate():
-	if not nextEngine:
-		initializeNextEngine()
-	with Session(nextEngine) as session:
-		return session.exec(
-			select(Date)
-		).first()
-	
-def getCurrentDate():
-	if not currentEngine:
-		initializeCurrentEngine()
-	with Session(currentEngine) as session:
+def approvedMembers() -> List[Member]:
+	with currentStore().readSession() as session:
+		return session.exec(select(Member).where(col(Member.status) == "approved")).all()
+
+def pendingMembers(limit:int) -> List[Member]:
+	with currentStore().readSession() as session:
 		return session.exec(
-			select(Date)
-		).first()
+			select(Member).where(col(Member.status) == "pending").order_by(col(Member.requestedAt)).limit(limit)
+		).all()
 
-def getMenuOptions() -> List[MenuOption]:
-	if not nextEngine:
-		initializeNextEngine()
-	with Session(nextEngine) as session:
+def requestMembership(idOfUser:int, chatId:int, firstName:str, lastName:str) -> Member:
+	with currentStore().writeSession() as session:
+		member = session.get(Member, idOfUser)
+		if member and member.status == "approved":
+			return member
+		if not member:
+			member = Member(id = idOfUser, status = "pending")
+			session.add(member)
+		member.chatId, member.firstName, member.lastName = chatId, firstName, lastName
+		member.status, member.requestedAt = "pending", datetime.now(timezone.utc)
+		session.commit()
+		return member
+
+def decideMembers(ids:List[int], status:str) -> List[Member]:
+	with currentStore().writeSession() as session:
+		# Only pending requests change, so a second click on the same button is a no-op.
+		members = session.exec(
+			select(Member).where(col(Member.id).in_(ids), col(Member.status) == "pending")
+		).all()
+		for member in members:
+			member.status = status
+		session.commit()
+		return members
+
+def revokeMembers(ids:List[int]) -> List[Member]:
+	with currentStore().writeSession() as session:
+		members = session.exec(
+			select(Member).where(col(Member.id).in_(ids), col(Member.status) == "approved", col(Member.isAdmin) == False)
+		).all()
+		for member in members:
+			member.status = "revoked"
+		session.commit()
+		return members
+
+def unvotedChatIds() -> List[int]:
+	with currentStore().readSession() as session:
+		voted = (
+			select(UserChoice.userid)
+			.join(Stage, col(Stage.generationId) == col(UserChoice.generationId))
+			.where(col(Stage.name) == "next")
+		)
 		return session.exec(
-			select(MenuOption)
+			select(Member.chatId).where(col(Member.status) == "approved", col(Member.id).not_in(voted))
 		).all()
 
-def updateUserChoice(idOfUser:int, idOfChoice:Optional[int]):
-	if not nextEngine:
-		initializeNextEngine()
-	with Session(nextEngine) as session:
-		userChoice = session.exec(
-			select(UserChoice).where(col(UserChoice.userid) == idOfUser)
-		).first()
-		if not userChoice:
-			session.add(
-				UserChoice(
-					userid = idOfUser,
-					choiceKey = idOfChoice
-				)
+def iterateOrders(stage:str) -> Iterator[Tuple[date, int, Optional[str]]]:
+	with currentStore().readSession() as session:
+		yield from session.exec(
+			select(MenuGeneration.date, UserChoice.userid, MenuOption.description)
+			.join(Stage, col(Stage.generationId) == col(UserChoice.generationId))
+			.join(MenuGeneration, col(MenuGeneration.id) == col(UserChoice.generationId))
+			.outerjoin(MenuOption, col(MenuOption.id) == col(UserChoice.choiceKey))
+			.where(col(Stage.name) == stage)
+			.order_by(col(MenuOption.position), col(UserChoice.userid))
+			.execution_options(yield_per=ExportBatchSize)
+		)
+
+class BroadcastProgress(NamedTuple):
+	id: int
+	text: str
+	createdAt: datetime
+	total: int
+	sent: int
+	failed: int
+	unknown: int
+	finishedAt: Optional[datetime]
+
+	@property
+	def pending(self) -> int:
+		return self.total - self.sent - self.failed - self.unknown
+
+def enqueueBroadcast(message:str, chatIds:List[int]) -> BroadcastProgress:
+	chatIds = list(dict.fromkeys(chatIds))
+	with currentStore().writeSession() as session:
+		broadcast = Broadcast(text = message, total = len(chatIds))
+		if not chatIds:
+			broadcast.finishedAt = datetime.now(timezone.utc)
+		session.add(broadcast)
+		session.flush()
+		if chatIds:
+			session.execute(insert(Delivery), [{"broadcastId": broadcast.id, "chatId": chatId, "status": "pending"} for chatId in chatIds])
+		session.commit()
+		return BroadcastProgress(broadcast.id, message, broadcast.createdAt, broadcast.total, 0, 0, 0, broadcast.finishedAt)
+
+def broadcastText(broadcastId:int) -> Optional[str]:
+	with currentStore().readSession() as session:
+		broadcast = session.get(Broadcast, broadcastId)
+		return broadcast.text if broadcast else None
+
+def claimDeliveries(broadcastId:int, limit:int) -> List[int]:
+	with currentStore().writeSession() as session:
+		chatIds = session.exec(
+			select(Delivery.chatId).where(col(Delivery.broadcastId) == broadcastId, col(Delivery.status) == "pending").limit(limit)
+		).all()
+		if chatIds:
+			# Committed before anything is sent, so a crash can never send these chats twice.
+			session.execute(
+				update(Delivery).where(col(Delivery.broadcastId) == broadcastId, col(Delivery.chatId).in_(chatIds)).values(status = "sending")
 			)
 		else:
-			userChoice.choiceKey = idOfChoice
-			session.add(userChoice)
+			session.execute(
+				update(Broadcast).where(col(Broadcast.id) == broadcastId, col(Broadcast.finishedAt).is_(None))
+				.values(finishedAt = datetime.now(timezone.utc))
+			)
 		session.commit()
+		return list(chatIds)
 
-def getUserChoice(idOfUser:str):
-	currentDate = currentChoice = nextDate = nextChoice = None
-	if not nextEngine:
-		initializeNextEngine()
-	if not currentEngine:
-		initializeCurrentEngine()
-	with Session(currentEngine) as session:
-		currentDate = session.exec(
-			select(Date)
-		).first()
-		currentChoiceId = session.exec(
-			select(UserChoice.choiceKey).where(col(UserChoice.userid) == idOfUser)
-		).first()
-		if currentChoiceId:
-			currentChoice = session.exec(
-				select(MenuOption).where(col(MenuOption.id) == currentChoiceId)
-			).first()
-	with Session(nextEngine) as session:
-		nextDate = session.exec(
-			select(Date)
-		).first()
-		nextChoiceId = session.exec(
-			select(UserChoice.choiceKey).where(col(UserChoice.userid) == idOfUser)
-		).first()
-		if nextChoiceId:
-			nextChoice = session.exec(
-				select(MenuOption).where(col(MenuOption.id) == nextChoiceId)
-			).first()
-	return [currentDate, currentChoice, nextDate, nextChoice]
+def finishDeliveries(broadcastId:int, sent:List[int], failed:List[int]):
+	with currentStore().writeSession() as session:
+		for status, chatIds in (("sent", sent), ("failed", failed)):
+			if chatIds:
+				session.execute(
+					update(Delivery)
+					.where(col(Delivery.broadcastId) == broadcastId, col(Delivery.chatId).in_(chatIds), col(Delivery.status) == "sending")
+					.values(status = status)
+				)
+		session.commit()
+
+def resumeBroadcasts(running:List[int]) -> List[int]:
+	with currentStore().writeSession() as session:
+		# Chats claimed when the process died may or may not have been messaged; they are not retried.
+		session.execute(
+			update(Delivery).where(col(Delivery.status) == "sending", col(Delivery.broadcastId).not_in(running)).values(status = "unknown")
+		)
+		session.commit()
+		return session.exec(select(Broadcast.id).where(col(Broadcast.finishedAt).is_(None)).order_by(col(Broadcast.id))).all()
+
+def pruneBroadcasts(finishedBefore:datetime) -> int:
+	with currentStore().writeSession() as session:
+		old = select(Broadcast.id).where(col(Broadcast.finishedAt) < finishedBefore)
+		session.execute(delete(Delivery).where(col(Delivery.broadcastId).in_(old)))
+		pruned = session.execute(delete(Broadcast).where(col(Broadcast.finishedAt) < finishedBefore)).rowcount
+		session.commit()
+		return pruned
+
+def broadcastProgress(limit:int) -> List[BroadcastProgress]:
+	def counted(status:str):
+		return func.count(Delivery.chatId).filter(col(Delivery.status) == status)
+	with currentStore().readSession() as session:
+		rows = session.exec(
+			select(
+				Broadcast.id, Broadcast.text, Broadcast.createdAt, Broadcast.total,
+				counted("sent"), counted("failed"), counted("unknown"), Broadcast.finishedAt
+			)
+			.outerjoin(Delivery, col(Delivery.broadcastId) == col(Broadcast.id))
+			.group_by(col(Broadcast.id))
+			.order_by(col(Broadcast.id).desc())
+			.limit(limit)
+		).all()
+		return [BroadcastProgress(*row) for row in rows]
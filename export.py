@@ -0,0 +1,57 @@
+import csv, importlib.util, io, tempfile
+from datetime import date
+from typing import (
+    BinaryIO,
+    Callable,
+    Iterable,
+    Optional,
+    Tuple
+)
+from telegram import InputFile
+
+Formats = ("csv", "xlsx")
+Header = ("date", "user id", "name", "dish")
+# Small exports stay in memory, bigger ones spill to a temporary file.
+SpoolSize = 1024 * 1024
+
+def available(fileFormat: str) -> bool:
+    # openpyxl is optional and only imported once an xlsx export is asked for.
+    return fileFormat == "csv" or importlib.util.find_spec("openpyxl") is not None
+
+def records(rows: Iterable[Tuple[date, int, Optional[str]]], nameOf: Callable[[int], str]):
+    for menuDate, userId, description in rows:
+        yield menuDate.isoformat(), userId, nameOf(userId), description or ""
+
+def writeCsv(rows, file: BinaryIO) -> None:
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(Header)
+    writer.writerows(rows)
+    text.flush()
+    # Leave the underlying file open for sending.
+    text.detach()
+
+def writeXlsx(rows, file: BinaryIO) -> None:
+    from openpyxl import Workbook
+    # Write-only workbooks stream rows to disk instead of building the sheet in memory.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("orders")
+    sheet.append(Header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+def document(rows: Iterable[Tuple[date, int, Optional[str]]], nameOf: Callable[[int], str], fileFormat: str) -> BinaryIO:
+    file = tempfile.SpooledTemporaryFile(max_size=SpoolSize)
+    try:
+        (writeXlsx if fileFormat == "xlsx" else writeCsv)(records(rows, nameOf), file)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+def upload(file: BinaryIO, filename: str) -> InputFile:
+    # A spooled file has no name of its own, and handing over the handle lets the upload
+    # stream it instead of reading it into memory first.
+    return InputFile(file, filename=filename, read_file_handle=False)
@@ -0,0 +1,161 @@
+import glob, logging, os, sqlite3
+import config, database
+from datetime import (
+    date,
+    datetime,
+    timedelta,
+    timezone
+)
+from typing import (
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+from sqlalchemy import (
+    event,
+    func,
+    insert
+)
+from sqlalchemy.orm import registry
+from sqlmodel import (
+    Field,
+    Session,
+    SQLModel,
+    col,
+    create_engine,
+    delete,
+    select
+)
+
+HistoryPath = "history.db"
+# Legacy next_* files are menus that were republished before closing, so nobody got that lunch.
+ArchivePatterns = (("current_*.db", True), ("next_*.db", False))
+
+class HistoryModel(SQLModel, registry=registry()):
+    pass
+
+class HistorySource(HistoryModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True)
+    menuDate: Optional[date] = None
+    closed: bool
+    ingestedAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class HistoryOrder(HistoryModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sourceId: int = Field(foreign_key="historysource.id", index=True)
+    menuDate: date = Field(index=True)
+    closed: bool
+    userid: int = Field(index=True)
+    description: Optional[str] = Field(default=None, index=True)
+
+engines = {}
+
+def officeDirectory() -> str:
+    # History and archives sit next to the office's lunchbot.db.
+    return os.path.dirname(database.currentStore().path)
+
+def historyEngine():
+    path = os.path.join(officeDirectory(), HistoryPath)
+    engine = engines.get(path)
+    if not engine:
+        engine = engines[path] = create_engine(f"sqlite:///{path}", pool_size=1, max_overflow=0)
+        event.listen(engine, "connect", database.configureConnection)
+        HistoryModel.metadata.create_all(engine)
+    return engine
+
+def readArchive(path: str) -> Tuple[Optional[date], List[Tuple[int, Optional[str]]]]:
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        menuDate = connection.execute("SELECT date FROM date LIMIT 1").fetchone()
+        rows = connection.execute(
+            "SELECT choice.userid, option.description FROM userchoice AS choice "
+            "LEFT JOIN menuoption AS option ON option.id = choice.choiceKey"
+        ).fetchall()
+    finally:
+        connection.close()
+    return (date.fromisoformat(menuDate[0]) if menuDate else None), rows
+
+def addSource(session: Session, name: str, menuDate: Optional[date], closed: bool, rows) -> None:
+    source = HistorySource(name=name, menuDate=menuDate, closed=closed)
+    session.add(source)
+    session.flush()
+    if menuDate and rows:
+        session.execute(insert(HistoryOrder), [
+            {"sourceId": source.id, "menuDate": menuDate, "closed": closed, "userid": userid, "description": description}
+            for userid, description in rows
+        ])
+    session.commit()
+
+def applyRetention(session: Session) -> None:
+    retentionDays = config.settings["historyRetentionDays"]
+    if retentionDays:
+        # Sources stay behind so expired archives are not ingested again.
+        session.exec(delete(HistoryOrder).where(col(HistoryOrder.menuDate) < date.today() - timedelta(days=retentionDays)))
+        session.commit()
+
+def ingest() -> int:
+    ingested = 0
+    with Session(historyEngine()) as session:
+        known = set(session.exec(select(HistorySource.name)).all())
+        for pattern, closed in ArchivePatterns:
+            for path in sorted(glob.glob(os.path.join(officeDirectory(), pattern))):
+                name = os.path.basename(path)
+                if name in known:
+                    continue
+                try:
+                    menuDate, rows = readArchive(path)
+                except sqlite3.DatabaseError as error:
+                    logging.error("skipping archive %s: %s", path, error)
+                    continue
+                addSource(session, name, menuDate, closed, rows)
+                ingested += 1
+                if config.settings["deleteIngestedArchives"]:
+                    os.remove(path)
+        generationId, menuDate, rows = database.stageOrders("current")
+        if generationId and f"generation:{generationId}" not in known:
+            addSource(session, f"generation:{generationId}", menuDate, True, rows)
+            ingested += 1
+        applyRetention(session)
+    logging.info("ingested %s history sources", ingested)
+    return ingested
+
+def popularDishes(since: date, limit: int = 10) -> List[Tuple[str, int]]:
+    with Session(historyEngine()) as session:
+        total = func.count(col(HistoryOrder.id))
+        return session.exec(
+            select(HistoryOrder.description, total)
+            .where(col(HistoryOrder.closed), col(HistoryOrder.description).is_not(None), col(HistoryOrder.menuDate) >= since)
+            .group_by(col(HistoryOrder.description))
+            .order_by(total.desc())
+            .limit(limit)
+        ).all()
+
+def participation(since: date) -> List[Tuple[int, int]]:
+    with Session(historyEngine()) as session:
+        total = func.count(col(HistoryOrder.id))
+        return session.exec(
+            select(HistoryOrder.userid, total)
+            .where(col(HistoryOrder.closed), col(HistoryOrder.description).is_not(None), col(HistoryOrder.menuDate) >= since)
+            .group_by(col(HistoryOrder.userid))
+            .order_by(total.desc())
+        ).all()
+
+def headcount(since: date) -> List[Tuple[date, int]]:
+    with Session(historyEngine()) as session:
+        return session.exec(
+            select(HistoryOrder.menuDate, func.count(col(HistoryOrder.id)))
+            .where(col(HistoryOrder.closed), col(HistoryOrder.description).is_not(None), col(HistoryOrder.menuDate) >= since)
+            .group_by(col(HistoryOrder.menuDate))
+            .order_by(col(HistoryOrder.menuDate))
+        ).all()
+
+def iterateOrders(since: date) -> Iterator[Tuple[date, int, Optional[str]]]:
+    with Session(historyEngine()) as session:
+        yield from session.exec(
+            select(HistoryOrder.menuDate, HistoryOrder.userid, HistoryOrder.description)
+            .where(col(HistoryOrder.closed), col(HistoryOrder.menuDate) >= since)
+            .order_by(col(HistoryOrder.menuDate), col(HistoryOrder.description), col(HistoryOrder.userid))
+            .execution_options(yield_per=database.ExportBatchSize)
+        )
@@ -0,0 +1,59 @@
+import atexit, functools, json, logging, queue, time
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler
+)
+
+LogPath = "lunchbot.log"
+MaxBytes = 10 * 1024 * 1024
+BackupCount = 5
+RecordFields = ("handler", "user", "chat", "duration")
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in RecordFields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    # Hand the raw record over; message formatting happens on the writer thread.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+listener = None
+
+def setupLogging(path: str = LogPath, maxBytes: int = MaxBytes, backupCount: int = BackupCount) -> None:
+    global listener
+    records = queue.SimpleQueue()
+    fileHandler = RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8")
+    fileHandler.setFormatter(JsonFormatter())
+    listener = QueueListener(records, fileHandler)
+    listener.start()
+    atexit.register(listener.stop)
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(logging.INFO)
+
+def logged(handler):
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            logging.info("handled", extra={
+                "handler": handler.__name__,
+                "user": update.effective_user.id if update.effective_user else None,
+                "chat": update.effective_chat.id if update.effective_chat else None,
+                "duration": round(time.perf_counter() - started, 6),
+            })
+    return wrapper
@@ -1,10 +1,33 @@
-import database as db
-import messages, json, logging
+import asyncdb as db
+import config, csv, database, export, history, io, messages, metrics, logging, offices, re, secrets
+from broadcast import (
+    Broadcaster,
+    DeliverySummary
+)
+from logpipeline import (
+    logged,
+    setupLogging
+)
+from menucache import OptOut
+from outbox import Outbox
+from persistence import SqlitePersistence
+from throttle import FloodControl
 from datetime import (
     date,
+    datetime,
+    time,
     timedelta
 )
+from zoneinfo import ZoneInfo
+import tzlocal
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
 from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     Update,
@@ -13,26 +36,31 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.error import BadRequest
 
 bot = None
-users = None
-admin = None
+broadcaster = None
+outbox = None
 NextState = 1
-
-def readUsers():
-    logging.info("reading users")
-    with open("users.json", "r") as file:
-        global users
-        global admin
-        data = json.load(file)
-        users = data["users"]
-        admin = data["admin"]
+HistoryDays = 30
+# Upper bound for periods when history is kept forever.
+MaxHistoryDays = 36500
+MaxItemLength = 100
+MaxMessageLength = 4096
+MaxDocumentSize = 64 * 1024
+MaxPendingListed = 40
+BroadcastsListed = 5
+WatchInterval = 30
+WatchDuration = 12 * 60 * 60
+ItemPrefix = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s*")
 
 def readToken() -> str:
     logging.info("reading token")
@@ -40,35 +68,62 @@ def readToken() -> str:
         return file.readline()
 
 def hasUserPrivileges(effectiveUser: User) -> bool:
-    return bool(list(filter(lambda x: x["id"] == effectiveUser["id"], users)))
+    return offices.current().registry.isUser(effectiveUser["id"])
 
 def hasAdminPrivileges(effectiveUser: User) -> bool:
-    return effectiveUser["id"] == admin["id"]
-
-async def announce(msg:str) -> None:
-    logging.info(f"announcing {msg}")
-    for user in users:
-        await bot.send_message(chat_id=user["chatid"], text=msg)
+    return offices.current().registry.isAdmin(effectiveUser["id"])
+
+async def announce(msg:str) -> database.BroadcastProgress:
+    logging.info("announcing %s", msg)
+    # Delivery runs in the background; the outbox reports back to the admin when it is done.
+    progress = await outbox.enqueue(offices.current().registry.chatIds(), msg)
+    logging.info("queued broadcast %s to %s chats", progress.id, progress.total)
+    return progress
+
+async def broadcastFinished(broadcastId: int, summary: DeliverySummary) -> None:
+    metrics.recordBroadcast(summary)
+    logging.info("announced to %s/%s in %.2fs, failed: %s", summary.sent, summary.total, summary.elapsed, summary.failedChats)
+    await notifyAdmin(messages.BroadcastFinished.format(id=broadcastId) + formatSummary(summary))
+
+def formatSummary(summary: DeliverySummary) -> str:
+    return messages.DeliverySummary.format(
+        sent=summary.sent, total=summary.total, failed=summary.failed,
+        retried=summary.retried, elapsed=summary.elapsed
+    )
 
+def formatQueued(progress: database.BroadcastProgress) -> str:
+    return messages.BroadcastQueued.format(id=progress.id, total=progress.total)
+
+async def publishMenu() -> database.BroadcastProgress:
+    await db.publish()
+    offices.current().menuCache.invalidate()
+    await db.refreshTally()
+    return await announce(msg="New menu dropped!")
+
+async def closeMenu(context: ContextTypes.DEFAULT_TYPE) -> database.BroadcastProgress:
+    await db.closeOrder()
+    offices.current().menuCache.invalidate()
+    await db.refreshTally()
+    progress = await announce(msg="Order closed!")
+    # The closed orders are folded into history.db after the reply, not ahead of it.
+    context.job_queue.run_once(ingestHistory, 0, data={"office": offices.current().name})
+    return progress
+
+@logged
 async def startCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("start command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     await update.message.reply_text(messages.StartMessage)
 
+@logged
 async def helpCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("help command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if hasAdminPrivileges(update.effective_user):
-        readUsers()
         await update.message.reply_text(messages.AdminHelp)
     elif hasUserPrivileges(update.effective_user):
         await update.message.reply_text(messages.UserHelp)
     else:
         await update.message.reply_text(messages.UnauthorizedAccess)
 
+@logged
 async def draftCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("draft command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return ConversationHandler.END
@@ -84,22 +139,20 @@ async def draftCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     )
     return NextState
 
+@logged
 async def draftCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("draft callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
+    logging.info("input: %s", update.message.text)
     try:
         draftDate = date.fromisoformat(update.message.text)
     except:
         await update.message.reply_text(messages.InvalidInput, reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
-    db.createDraft(menuDate=draftDate)
+    await db.createDraft(menuDate=draftDate)
     await update.message.reply_text(messages.DraftCreated, reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
+@logged
 async def cancelCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("cancel command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     await update.message.reply_text(messages.OperationCanceled, reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
@@ -109,36 +162,73 @@ draftHandler = ConversationHandler(
         NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT, draftCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="draft",
+    persistent=True,
 )
 
+@logged
 async def addItemCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("add command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return ConversationHandler.END
     await update.message.reply_text(messages.ItemAddition)
     return NextState
 
+def parseMenuItems(content: str, isCsv: bool) -> Tuple[List[str], int]:
+    lines = [row[0] if row else "" for row in csv.reader(io.StringIO(content))] if isCsv else content.splitlines()
+    items, seen, skipped = [], set(), 0
+    for line in lines:
+        item = ItemPrefix.sub("", line).strip()
+        if not item or len(item) > MaxItemLength or item.casefold() in seen:
+            skipped += 1 if item else 0
+            continue
+        seen.add(item.casefold())
+        items.append(item)
+    return items, skipped
+
+async def readMenuItems(update: Update) -> Optional[Tuple[List[str], int]]:
+    document = update.message.document
+    if not document:
+        return parseMenuItems(update.message.text, isCsv=False)
+    if document.file_size and document.file_size > MaxDocumentSize:
+        return None
+    try:
+        content = (await (await document.get_file()).download_as_bytearray()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return None
+    isCsv = (document.file_name or "").lower().endswith(".csv") or document.mime_type == "text/csv"
+    return parseMenuItems(content, isCsv)
+
+@logged
 async def addItemCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("add callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
-    db.addMenuOption(update.message.text)
-    await update.message.reply_text(messages.ItemAdded, reply_markup=ReplyKeyboardRemove())
+    logging.info("input: %s", update.message.text or update.message.document.file_name)
+    parsed = await readMenuItems(update)
+    if not parsed:
+        await update.message.reply_text(messages.InvalidInput, reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    items, skipped = parsed
+    result = await db.addMenuOptions(items)
+    if result is None:
+        await update.message.reply_text(messages.NoDraft, reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    added, options = result
+    msg = '\n'.join([str(option.position) + ". " + option.description for option in options])
+    msg = messages.ItemsAdded.format(added=added, skipped=skipped + len(items) - added) + "\n" + msg + "\n" + messages.ItemAdded
+    await update.message.reply_text(msg, reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 addItemHandler = ConversationHandler(
     entry_points=[CommandHandler("add", addItemCommand)],
     states={
-        NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT, addItemCallback)]
+        NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT | filters.Document.ALL, addItemCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="addItem",
+    persistent=True,
 )
 
+@logged
 async def publishCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("publish command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return ConversationHandler.END
@@ -152,15 +242,13 @@ async def publishCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return NextState
 
+@logged
 async def publishCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("publish callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if update.message.text != "Yes":
         await update.message.reply_text(messages.OperationCanceled, reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
-    db.publish()
-    await announce(msg="New menu dropped!")
-    await update.message.reply_text(messages.PublishAsserted, reply_markup=ReplyKeyboardRemove())
+    progress = await publishMenu()
+    await update.message.reply_text(messages.PublishAsserted + formatQueued(progress), reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 publishHandler = ConversationHandler(
@@ -169,80 +257,76 @@ publishHandler = ConversationHandler(
         NextState: [MessageHandler(filters.Regex("^(Yes|No)$"), publishCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="publish",
+    persistent=True,
 )
 
-async def optionsCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("options command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
+@logged
+async def optionsCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not hasUserPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
-        return ConversationHandler.END
-    options = db.getMenuOptions()
-    msg = '\n'.join([str(option.id) + ". " + option.description for option in options])
-    msg = db.getNextDate().date.strftime("%a %b %d, %Y") + "\n" + msg
-    replyKeyboard = [[str(option.id) for option in options], ["Opt-out"]]
-    await update.message.reply_text(msg,
-        reply_markup=ReplyKeyboardMarkup(
-            replyKeyboard, one_time_keyboard=True,
-            resize_keyboard=True
-        ),
-    )
-    return NextState
+        return
+    menu = await offices.current().menuCache.get()
+    if menu.generation is None:
+        await update.message.reply_text(messages.NoMenu)
+        return
+    await update.message.reply_text(menu.message, reply_markup=menu.keyboard)
 
-async def optionsCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("options callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
-    userInput = -1
+async def editMenu(query, text: str, keyboard: Optional[InlineKeyboardMarkup]) -> None:
     try:
-        if update.message.text == "Opt-out":
-            userInput = None
-        elif 1 <= int(update.message.text) <= len(db.getMenuOptions()):
-            userInput = int(update.message.text)
-        if userInput == -1:
-            await update.message.reply_text(messages.InvalidInput, reply_markup=ReplyKeyboardRemove())
-            return ConversationHandler.END
-    except:
-        await update.message.reply_text(messages.InvalidInput, reply_markup=ReplyKeyboardRemove())
-        return ConversationHandler.END
-    db.updateUserChoice(idOfUser=update.effective_user["id"], idOfChoice=userInput)
-    await update.message.reply_text(messages.OptionSelected, reply_markup=ReplyKeyboardRemove())
-    return ConversationHandler.END
-
-optionsHandler = ConversationHandler(
-    entry_points=[CommandHandler("options", optionsCommand)],
-    states={
-        NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT, optionsCallback)]
-    },
-    fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
-)
+        await query.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest as error:
+        # Pressing the button that is already chosen leaves the message unchanged.
+        logging.debug("menu message not edited: %s", error)
+
+@logged
+async def voteCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if not hasUserPrivileges(update.effective_user):
+        await query.answer(messages.UnauthorizedAccess.strip(), show_alert=True)
+        return
+    _, generation, optionId = query.data.split(":")
+    generation, optionId = int(generation), int(optionId)
+    # Buttons carry the generation they were rendered for, so the cached menu is enough to validate them.
+    menu = await offices.current().menuCache.get()
+    valid = generation == menu.generation and (optionId == OptOut or optionId in menu.choices)
+    if not valid or not await db.updateUserChoice(
+        idOfUser=update.effective_user["id"], idOfChoice=None if optionId == OptOut else optionId, generationId=generation
+    ):
+        await query.answer(messages.MenuChanged.strip(), show_alert=True)
+        if menu.generation is None:
+            await editMenu(query, messages.NoMenu, None)
+        else:
+            await editMenu(query, menu.message, menu.keyboard)
+        return
+    await query.answer(messages.OptionSelected.strip())
+    choice = menu.choices.get(optionId, "Nothing")
+    await editMenu(query, menu.message + "\n" * 2 + messages.YourChoice.format(choice=choice).strip(), menu.keyboard)
 
+@logged
 async def mineCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("mine command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasUserPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return
-    currentDate, currentChoice, nextDate, nextChoice = db.getUserChoice(idOfUser=update.effective_user["id"])
+    currentDate, currentChoice, nextDate, nextChoice = await db.getUserChoice(idOfUser=update.effective_user["id"])
     msg = ''
     if currentDate:
-        msg = msg + currentDate.date.strftime("%a %b %d, %Y") + "\n"
+        msg = msg + currentDate.strftime("%a %b %d, %Y") + "\n"
         if currentChoice:
-            msg = msg + currentChoice.description
+            msg = msg + currentChoice
         else:
             msg = msg + "Nothing"
     msg = msg + "\n\n"
     if nextDate:
-        msg = msg + nextDate.date.strftime("%a %b %d, %Y") + "\n"
+        msg = msg + nextDate.strftime("%a %b %d, %Y") + "\n"
         if nextChoice:
-            msg = msg + nextChoice.description
+            msg = msg + nextChoice
         else:
             msg = msg + "Nothing"
     await update.message.reply_text(msg)
 
+@logged
 async def closeCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("close command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return ConversationHandler.END
@@ -256,16 +340,14 @@ async def closeCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     )
     return NextState
 
+@logged
 async def closeCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("close callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
+    logging.info("input: %s", update.message.text)
     if update.message.text != "Yes":
         await update.message.reply_text(messages.OperationCanceled, reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
-    db.closeOrder()
-    await announce(msg="Order closed!")
-    await update.message.reply_text(messages.OrderClosed, reply_markup=ReplyKeyboardRemove())
+    progress = await closeMenu(context)
+    await update.message.reply_text(messages.OrderClosed + formatQueued(progress), reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 closeHandler = ConversationHandler(
@@ -274,64 +356,235 @@ closeHandler = ConversationHandler(
         NextState: [MessageHandler(filters.Regex("^(Yes|No)$"), closeCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="close",
+    persistent=True,
 )
 
+@logged
 async def previewCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("preview command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return
-    msg = '\n'.join([str(option.id) + ". " + option.description for option in db.preview()])
+    msg = '\n'.join([str(option.position) + ". " + option.description for option in await db.preview()])
     msg = msg + '\n\n' + messages.PreviewDraft
     await update.message.reply_text(msg)
 
 def generateList(items) -> str:
+    name = offices.current().registry.name
     msgs = []
     for item in items:
-        msgs.append(item["option"].description + " Total: " + str(len(item["users"])))
-        for user in item["users"]:
-            foundUser = list(filter(lambda x: x["id"] == user.userid, users))[-1]
-            msgs.append(foundUser["firstName"] + " " + foundUser["lastName"])
+        msgs.append(item.description + " Total: " + str(item.total))
+        msgs.extend(map(name, item.userIds))
         msgs.append("")
     msg = '\n'.join(msgs)
     return msg
 
+async def statusText() -> str:
+    # Served from the in-memory tally kept current by every accepted vote.
+    liveTally = db.shard().liveTally
+    rows = liveTally.rows() if liveTally.ready else await db.status()
+    return ((await offices.current().menuCache.get()).header + "\n" * 2 + generateList(rows))[:MaxMessageLength]
+
+@logged
 async def statusCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("status command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return
-    msg = db.getNextDate().date.strftime("%a %b %d, %Y") + "\n" * 2 + generateList(db.status())
-    await update.message.reply_text(msg)
+    await update.message.reply_text(await statusText())
+
+def stopWatching(context: ContextTypes.DEFAULT_TYPE, chatId: int) -> bool:
+    jobs = context.job_queue.get_jobs_by_name(f"watch-{chatId}")
+    for job in jobs:
+        job.schedule_removal()
+    return bool(jobs)
+
+async def refreshWatch(context: ContextTypes.DEFAULT_TYPE) -> None:
+    job = context.job
+    with offices.using(offices.offices[job.data["office"]]):
+        text = await statusText()
+    if text == job.data["text"]:
+        return
+    try:
+        await context.bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.data["messageId"])
+    except BadRequest as error:
+        # Telegram may normalise whitespace, so an edit can still find nothing to change.
+        if "not modified" not in str(error).lower():
+            logging.warning("stopped watching in chat %s: %s", job.chat_id, error)
+            job.schedule_removal()
+            return
+    job.data["text"] = text
+
+@logged
+async def watchCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    chatId = update.effective_chat.id
+    stopWatching(context, chatId)
+    text = await statusText()
+    message = await update.message.reply_text(text)
+    # Compare against what was sent; Telegram returns the text with surrounding whitespace trimmed.
+    context.job_queue.run_repeating(
+        refreshWatch, interval=WatchInterval, last=WatchDuration, name=f"watch-{chatId}",
+        chat_id=chatId, data={"office": offices.current().name, "messageId": message.message_id, "text": text}
+    )
+
+@logged
+async def unwatchCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    stopped = stopWatching(context, update.effective_chat.id)
+    await update.message.reply_text(messages.Unwatched if stopped else messages.NotWatching)
 
+@logged
 async def reportCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("report command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return
-    msg = db.getCurrentDate().date.strftime("%a %b %d, %Y") + "\n" * 2 + generateList(db.report())
+    msg = (await db.getCurrentDate()).strftime("%a %b %d, %Y") + "\n" * 2 + generateList(await db.report())
     await update.message.reply_text(msg)
 
+@logged
+async def exportCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    args = [arg.lower() for arg in context.args or []]
+    fileFormat = next((arg for arg in args if arg in export.Formats), "csv")
+    days = next((int(arg) for arg in args if arg.isdigit()), None)
+    if not export.available(fileFormat):
+        await update.message.reply_text(messages.ExportUnavailable.format(format=fileFormat))
+        return
+    # Rows are pulled from the database cursor on the worker thread as the file is written.
+    if days is None:
+        currentDate = await db.getCurrentDate()
+        if not currentDate:
+            await update.message.reply_text(messages.NothingToExport)
+            return
+        filename = f"orders-{currentDate.isoformat()}.{fileFormat}"
+        document = await db.read(export.document, database.iterateOrders("current"), userName, fileFormat)
+    else:
+        since = daysAgo(days)
+        filename = f"history-from-{since.isoformat()}.{fileFormat}"
+        document = await db.background(export.document, history.iterateOrders(since), userName, fileFormat)
+    with document:
+        await update.message.reply_document(export.upload(document, filename))
+
+def daysAgo(days: int) -> date:
+    # history.db holds nothing older than its retention, so longer periods are cut to it.
+    return date.today() - timedelta(days=min(max(days, 0), config.settings["historyRetentionDays"] or MaxHistoryDays))
+
+def historySince(context: ContextTypes.DEFAULT_TYPE) -> date:
+    try:
+        days = int(context.args[0]) if context.args else HistoryDays
+    except ValueError:
+        days = HistoryDays
+    return daysAgo(days)
+
+def userName(userId: int) -> str:
+    return offices.current().registry.name(userId)
+
+@logged
+async def popularCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    since = historySince(context)
+    rows = await db.background(history.popularDishes, since)
+    msg = '\n'.join([description + ": " + str(total) for description, total in rows]) or messages.NoHistory
+    await update.message.reply_text(since.strftime("Since %a %b %d, %Y") + "\n" * 2 + msg)
+
+@logged
+async def participationCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    since = historySince(context)
+    rows = await db.background(history.participation, since)
+    msg = '\n'.join([userName(userId) + ": " + str(total) for userId, total in rows]) or messages.NoHistory
+    await update.message.reply_text(since.strftime("Since %a %b %d, %Y") + "\n" * 2 + msg)
+
+@logged
+async def headcountCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    since = historySince(context)
+    rows = await db.background(history.headcount, since)
+    msg = '\n'.join([menuDate.strftime("%a %b %d, %Y") + ": " + str(total) for menuDate, total in rows]) or messages.NoHistory
+    await update.message.reply_text(since.strftime("Since %a %b %d, %Y") + "\n" * 2 + msg)
+
+@logged
+async def metricsCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    await update.message.reply_text((metrics.summary() or messages.NoMetrics)[:MaxMessageLength])
+
+@logged
+async def broadcastsCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    broadcasts = await db.broadcastProgress(BroadcastsListed)
+    if not broadcasts:
+        await update.message.reply_text(messages.NoBroadcasts)
+        return
+    lines = [
+        messages.BroadcastProgress.format(
+            id=progress.id, createdAt=progress.createdAt.strftime("%b %d %H:%M"),
+            state=messages.BroadcastDone if progress.finishedAt else messages.BroadcastRunning,
+            sent=progress.sent, total=progress.total, failed=progress.failed,
+            unknown=progress.unknown, pending=progress.pending, text=progress.text[:40]
+        ).strip()
+        for progress in broadcasts
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+@logged
 async def registerCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("register command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
+    if context.args and not hasUserPrivileges(update.effective_user):
+        if context.args[0] not in offices.offices:
+            await update.message.reply_text(messages.UnknownOffice.format(offices=", ".join(offices.offices)))
+            return ConversationHandler.END
+        context.user_data["office"] = context.args[0]
+        offices.activate(offices.offices[context.args[0]])
     if hasUserPrivileges(update.effective_user):
         await update.message.reply_text(messages.AlreadyRegistered)
         return ConversationHandler.END
     await update.message.reply_text(messages.RegisterName)
     return NextState
 
+def approvalKeyboard(members) -> InlineKeyboardMarkup:
+    rows = [
+        [
+            InlineKeyboardButton(f"Approve {member.firstName} {member.lastName}".strip(), callback_data=f"approve:{member.id}"),
+            InlineKeyboardButton("Reject", callback_data=f"reject:{member.id}"),
+        ]
+        for member in members
+    ]
+    if len(members) > 1:
+        rows.append([InlineKeyboardButton("Approve all", callback_data="approve:all")])
+    return InlineKeyboardMarkup(rows)
+
+@logged
 async def registerCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("register callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
-    with open("toRegister.txt", "a") as file:
-        file.write(f"{update.message.text}, {update.effective_user}, {update.effective_chat.id}\n")
-    await update.message.reply_text(f"""OK "{update.message.text}". """ + messages.RegisterMessage)
-    await bot.send_message(chat_id=admin["chatid"], text=f"{update.message.text}, {update.effective_user}, {update.effective_chat}")
+    logging.info("input: %s", update.message.text)
+    name = update.message.text.strip()[:MaxItemLength]
+    firstName, _, lastName = name.partition(" ")
+    member = await db.requestMembership(update.effective_user["id"], update.effective_chat.id, firstName, lastName.strip())
+    if member.status == "approved":
+        await update.message.reply_text(messages.AlreadyRegistered)
+        return ConversationHandler.END
+    await update.message.reply_text(f"""OK "{name}". """ + messages.RegisterMessage)
+    admin = offices.current().registry.admin
+    if admin:
+        await bot.send_message(
+            chat_id=admin["chatid"],
+            text=messages.RegistrationRequest.format(name=name, userId=member.id),
+            reply_markup=approvalKeyboard([member])
+        )
     return ConversationHandler.END
 
 registerHandler = ConversationHandler(
@@ -340,22 +593,75 @@ registerHandler = ConversationHandler(
         NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT, registerCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="register",
+    persistent=True,
 )
 
+@logged
+async def approveCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    pending = await db.pendingMembers(MaxPendingListed)
+    if not pending:
+        await update.message.reply_text(messages.NoPendingUsers)
+        return
+    await update.message.reply_text(messages.PendingUsers.format(count=len(pending)), reply_markup=approvalKeyboard(pending))
+
+@logged
+async def approvalCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if not hasAdminPrivileges(update.effective_user):
+        await query.answer(messages.UnauthorizedAccess.strip(), show_alert=True)
+        return
+    action, _, target = query.data.partition(":")
+    keyboard = query.message.reply_markup.inline_keyboard if query.message and query.message.reply_markup else ()
+    # Each user row starts with its approve button; "Approve all" means every user still listed.
+    listed = {int(row[0].callback_data.partition(":")[2]): row for row in keyboard if row[0].callback_data != "approve:all"}
+    ids = list(listed) if target == "all" else [int(target)]
+    status = "approved" if action == "approve" else "rejected"
+    members = await db.decideMembers(ids, status)
+    if status == "approved":
+        offices.admit(offices.current(), members)
+    await query.answer(messages.MembersDecided.format(count=len(members), status=status).strip())
+    if status == "approved" and members:
+        await outbox.enqueue([member.chatId for member in members], messages.RegistrationApproved)
+    remaining = [row for userId, row in listed.items() if userId not in ids]
+    if len(remaining) > 1:
+        remaining.append([InlineKeyboardButton("Approve all", callback_data="approve:all")])
+    await query.edit_message_reply_markup(InlineKeyboardMarkup(remaining) if remaining else None)
+
+@logged
+async def revokeCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not hasAdminPrivileges(update.effective_user):
+        await update.message.reply_text(messages.UnauthorizedAccess)
+        return
+    ids = [int(arg) for arg in context.args or [] if arg.isdigit()]
+    if not ids:
+        await update.message.reply_text(messages.RevokeUsage)
+        return
+    # Admins are never revoked, so an admin cannot lock the office out.
+    members = await db.revokeMembers(ids)
+    offices.dismiss(offices.current(), [member.id for member in members])
+    await update.message.reply_text(messages.MembersRevoked.format(
+        count=len(members), names=", ".join(f"{member.firstName} {member.lastName}".strip() for member in members) or "-"
+    ))
+    if members:
+        await outbox.enqueue([member.chatId for member in members], messages.AccessRevoked)
+
+@logged
 async def announceCommand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("announce command received")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
     if not hasAdminPrivileges(update.effective_user):
         await update.message.reply_text(messages.UnauthorizedAccess)
         return ConversationHandler.END
     await update.message.reply_text(messages.AnnounceMessage)
     return NextState
 
+@logged
 async def announceCallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    logging.info("announce callback invoked")
-    logging.info(f"{update.effective_user}, {update.effective_chat}")
-    logging.info(update.message.text)
-    await announce(update.message.text)
+    logging.info("input: %s", update.message.text)
+    progress = await announce(update.message.text)
+    await update.message.reply_text(formatQueued(progress))
     return ConversationHandler.END
 
 announceHandler = ConversationHandler(
@@ -364,29 +670,167 @@ announceHandler = ConversationHandler(
         NextState: [CommandHandler("cancel", cancelCommand), MessageHandler(filters.TEXT, announceCallback)]
     },
     fallbacks=[MessageHandler(filters.TEXT, cancelCommand)],
+    name="announce",
+    persistent=True,
 )
 
-def main() -> None:
-    logging.basicConfig(filename="lunchbot.log", encoding='utf-8', level=logging.INFO)
-    readUsers()
-    global bot
-    application = Application.builder().token(readToken()).build()
-    bot = application.bot
+metricsServer = None
+Weekdays = config.Weekdays
+
+def scheduleTime(text: str) -> time:
+    hours, minutes = text.split(":")
+    # A named zone rather than today's UTC offset, so jobs keep their wall clock time across DST changes.
+    zone = ZoneInfo(config.settings["timezone"]) if config.settings["timezone"] else tzlocal.get_localzone()
+    return time(int(hours), int(minutes), tzinfo=zone)
+
+async def notifyAdmin(text: str) -> None:
+    admin = offices.current().registry.admin
+    if admin:
+        await bot.send_message(chat_id=admin["chatid"], text=text)
+
+async def scheduledPublish(context: ContextTypes.DEFAULT_TYPE) -> None:
+    with offices.using(offices.offices[context.job.data["office"]]):
+        # Publishing without a draft would wipe the menu that is currently open.
+        if not await db.preview():
+            await notifyAdmin(messages.ScheduledPublishSkipped)
+            return
+        progress = await publishMenu()
+        await notifyAdmin(messages.PublishAsserted + formatQueued(progress))
+
+async def scheduledClose(context: ContextTypes.DEFAULT_TYPE) -> None:
+    with offices.using(offices.offices[context.job.data["office"]]):
+        if not await db.getNextDate():
+            return
+        progress = await closeMenu(context)
+        await notifyAdmin(messages.OrderClosed + formatQueued(progress))
+
+async def sendReminders(context: ContextTypes.DEFAULT_TYPE) -> None:
+    with offices.using(offices.offices[context.job.data["office"]]):
+        nextDate = await db.getNextDate()
+        if not nextDate:
+            return
+        chatIds = await db.unvotedChatIds()
+        summary = await broadcaster.broadcast(chatIds, messages.Reminder.format(date=nextDate.strftime("%a %b %d, %Y")))
+        metrics.recordBroadcast(summary)
+        logging.info("reminded %s/%s users in %.2fs", summary.sent, summary.total, summary.elapsed)
+
+def scheduleJobs(jobQueue) -> None:
+    lead = timedelta(minutes=config.settings["reminderMinutes"])
+    for office in offices.offices.values():
+        data = {"office": office.name}
+        for day, at in config.settings["publishTimes"].items():
+            jobQueue.run_daily(scheduledPublish, scheduleTime(at), days=(Weekdays.index(day),), name=f"publish-{office.name}-{day}", data=data)
+        for day, at in config.settings["closeTimes"].items():
+            closeAt = datetime.combine(date.today(), scheduleTime(at))
+            jobQueue.run_daily(scheduledClose, closeAt.timetz(), days=(Weekdays.index(day),), name=f"close-{office.name}-{day}", data=data)
+            if lead:
+                remindAt = closeAt - lead
+                # A reminder before an early morning close can fall on the previous day.
+                day = (Weekdays.index(day) + (remindAt.date() - closeAt.date()).days) % 7
+                jobQueue.run_daily(sendReminders, remindAt.timetz(), days=(day,), name=f"remind-{office.name}-{Weekdays[day]}", data=data)
+
+async def ingestHistory(context: ContextTypes.DEFAULT_TYPE) -> None:
+    data = context.job.data if context.job else None
+    for office in [offices.offices[data["office"]]] if data else offices.offices.values():
+        with offices.using(office):
+            await db.background(history.ingest)
+
+async def resumeBroadcasts() -> None:
+    for office in offices.offices.values():
+        with offices.using(office):
+            resumed = await outbox.resume()
+        if resumed:
+            logging.info("resuming broadcasts %s in %s", resumed, office.name)
+
+async def postInit(application: Application) -> None:
+    global metricsServer
+    # Archives are folded in behind the first updates rather than ahead of them.
+    application.job_queue.run_once(ingestHistory, 0)
+    scheduleJobs(application.job_queue)
+    # Before any update is accepted, so nothing claimed by this process can be mistaken for a crash leftover.
+    await resumeBroadcasts()
+    for office in offices.offices.values():
+        with offices.using(office):
+            await db.refreshTally()
+            await office.menuCache.get()
+    if config.settings["metricsPort"]:
+        metricsServer = await metrics.startServer(config.settings["metricsHost"], config.settings["metricsPort"])
+
+async def postShutdown(application: Application) -> None:
+    if metricsServer:
+        metricsServer.close()
+        await metricsServer.wait_closed()
+    await outbox.stop()
+    for office in offices.offices.values():
+        with offices.using(office):
+            await db.shutdown()
+
+async def routeUpdate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Runs ahead of every handler; the office stays active for the rest of this update.
+    userId = update.effective_user.id if update.effective_user else None
+    offices.activate(offices.route(userId, context.user_data.get("office") if context.user_data is not None else None))
+
+def registerHandlers(application: Application) -> None:
+    application.add_handler(TypeHandler(Update, routeUpdate), group=-1)
     application.add_handler(CommandHandler("start", startCommand))
     application.add_handler(CommandHandler("help", helpCommand))
     application.add_handler(draftHandler)
     application.add_handler(addItemHandler)
     application.add_handler(publishHandler)
-    application.add_handler(optionsHandler)
+    application.add_handler(CommandHandler("options", optionsCommand))
+    application.add_handler(CallbackQueryHandler(voteCallback, pattern=r"^v:\d+:\d+$"))
     application.add_handler(CommandHandler("mine", mineCommand))
     application.add_handler(closeHandler)
     application.add_handler(CommandHandler("preview", previewCommand))
     application.add_handler(CommandHandler("status", statusCommand))
+    application.add_handler(CommandHandler("watch", watchCommand))
+    application.add_handler(CommandHandler("unwatch", unwatchCommand))
     application.add_handler(CommandHandler("report", reportCommand))
+    application.add_handler(CommandHandler("export", exportCommand))
+    application.add_handler(CommandHandler("popular", popularCommand))
+    application.add_handler(CommandHandler("participation", participationCommand))
+    application.add_handler(CommandHandler("headcount", headcountCommand))
     application.add_handler(registerHandler)
+    application.add_handler(CommandHandler("approve", approveCommand))
+    application.add_handler(CallbackQueryHandler(approvalCallback, pattern=r"^(approve|reject):(\d+|all)$"))
+    application.add_handler(CommandHandler("revoke", revokeCommand))
     application.add_handler(announceHandler)
+    application.add_handler(CommandHandler("broadcasts", broadcastsCommand))
+    application.add_handler(CommandHandler("metrics", metricsCommand))
     application.add_handler(CommandHandler("cancel", cancelCommand))
-    application.run_polling()
+    metrics.instrument(application.handlers[0])
+
+def main() -> None:
+    setupLogging()
+    offices.load()
+    global bot
+    global broadcaster
+    global outbox
+    application = (
+        Application.builder().token(readToken())
+        .concurrent_updates(FloodControl(
+            config.settings["concurrentUpdates"], config.settings["floodRate"],
+            config.settings["floodBurst"], config.settings["registerInterval"], messages.Throttled.strip()
+        ))
+        .persistence(SqlitePersistence())
+        .post_init(postInit).post_shutdown(postShutdown).build()
+    )
+    bot = application.bot
+    broadcaster = Broadcaster(bot)
+    outbox = Outbox(broadcaster, broadcastFinished, retentionDays=config.settings["broadcastRetentionDays"])
+    registerHandlers(application)
+    if config.settings["mode"] == "webhook":
+        # Stopping closes the HTTP server first and then drains updates already accepted.
+        application.run_webhook(
+            listen=config.settings["webhookListen"],
+            port=config.settings["webhookPort"],
+            url_path=config.settings["webhookPath"],
+            webhook_url=config.settings["webhookUrl"],
+            secret_token=config.settings["webhookSecret"] or secrets.token_urlsafe(32),
+            max_connections=config.settings["webhookMaxConnections"],
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
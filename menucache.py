@@ -0,0 +1,57 @@
+import asyncio
+import asyncdb as db
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional
+)
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup
+)
+
+# Option ids start at 1, so 0 is free to mean opting out.
+OptOut = 0
+
+class MenuSnapshot(NamedTuple):
+    generation: Optional[int]
+    options: List[db.database.MenuRow]
+    choices: Dict[int, str]
+    header: str
+    message: str
+    keyboard: InlineKeyboardMarkup
+
+class MenuCache:
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[MenuSnapshot] = None
+        self.lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self.version += 1
+        self.snapshot = None
+
+    async def load(self) -> MenuSnapshot:
+        generation, nextDate, options = await db.getNextMenu()
+        header = nextDate.strftime("%a %b %d, %Y") if nextDate else ""
+        message = header + "\n" + '\n'.join([str(option.position) + ". " + option.description for option in options])
+        keyboard = InlineKeyboardMarkup([
+            *[[InlineKeyboardButton(f"{option.position}. {option.description}", callback_data=f"v:{generation}:{option.id}")] for option in options],
+            [InlineKeyboardButton("Opt-out", callback_data=f"v:{generation}:{OptOut}")],
+        ])
+        choices = {option.id: option.description for option in options}
+        return MenuSnapshot(generation, options, choices, header, message, keyboard)
+
+    async def get(self) -> MenuSnapshot:
+        snapshot = self.snapshot
+        if snapshot:
+            return snapshot
+        async with self.lock:
+            if not self.snapshot:
+                version = self.version
+                snapshot = await self.load()
+                # A publish or close while loading makes this snapshot stale already.
+                if version == self.version:
+                    self.snapshot = snapshot
+            return self.snapshot or snapshot
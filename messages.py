@@ -17,9 +17,19 @@ If you republish a draft all user choices will be gone!
 
 /preview lists draft menu items for review
 /status gives you status report on next menu
+/watch keeps a status message here updated as votes come in, /unwatch stops it
 /report gives you full report on closed menu
+/export [days] [csv|xlsx] sends the closed menu's orders, or the last days of history, as a file
 
 /announce send announcements to users
+/broadcasts shows how far recent announcements got
+/approve lists pending registrations to approve or reject
+/revoke <user id> ... removes approved users
+
+/popular [days] lists the most ordered dishes
+/participation [days] counts orders per user
+/headcount [days] counts orders per day
+/metrics shows handler and database latencies
 
 /options will give the menu for the next day
 /mine will remind you of your choice
@@ -40,10 +50,16 @@ DraftCreated = """
 Draft created. Use /add to add options.
 """
 ItemAddition = """
-Type the item or /cancel.
+Type the item, or paste several items one per line, or send a text or CSV file. Or /cancel.
+"""
+NoDraft = """
+There is no draft. Use /draft to create one.
+"""
+ItemsAdded = """
+Added {added} items, skipped {skipped} duplicate or invalid lines.
 """
 ItemAdded = """
-Item added. Use /add to add more options. If done use /preview then /publish.
+Use /add to add more options. If done use /preview then /publish.
 """
 PublishAssertion = """
 Are you sure? This will overwrite the ongoing orders that are not closed.
@@ -54,6 +70,15 @@ Menu published. use /options to see the menu and order your lunch.
 OptionSelected = """
 Order updated. You can check using /mine.
 """
+YourChoice = """
+Your choice: {choice}
+"""
+NoMenu = """
+There is no menu open for orders right now.
+"""
+MenuChanged = """
+The menu has changed since. Use /options to see the new menu.
+"""
 OrderClosure = """
 Are you sure? This will overwrite the closed orders.
 """
@@ -72,6 +97,85 @@ Please provide your name or /cancel.
 AlreadyRegistered = """
 You are registered. Use /options to see the menu.
 """
+RegistrationRequest = """
+{name} ({userId}) wants to register.
+"""
+PendingUsers = """
+{count} pending registrations:
+"""
+NoPendingUsers = """
+No pending registrations.
+"""
+RegistrationApproved = """
+You are registered now. Use /options to see the menu.
+"""
+MembersDecided = """
+{count} registrations {status}.
+"""
+RevokeUsage = """
+Usage: /revoke <user id> [<user id> ...]. Registration requests and /export files show user ids.
+"""
+MembersRevoked = """
+{count} users revoked: {names}
+"""
+AccessRevoked = """
+Your access to the lunch bot was revoked.
+"""
 AnnounceMessage = """
 Type your message to all. Or /cancel.
 """
+DeliverySummary = """
+Delivered to {sent} of {total} users in {elapsed:.1f}s ({failed} failed, {retried} retried).
+"""
+BroadcastQueued = """
+Broadcast #{id} is being sent to {total} users. You will get a summary when it is done, /broadcasts shows progress.
+"""
+BroadcastFinished = """
+Broadcast #{id} finished.
+"""
+BroadcastProgress = """
+#{id} {createdAt} {state}: {sent}/{total} sent, {failed} failed, {unknown} unknown, {pending} pending. {text}
+"""
+BroadcastDone = "done"
+BroadcastRunning = "sending"
+NoBroadcasts = """
+No announcements sent yet.
+"""
+NoHistory = """
+No orders in this period.
+"""
+NoMetrics = """
+No metrics recorded yet.
+"""
+
+Unwatched = """
+Stopped updating the status message.
+"""
+
+NotWatching = """
+No status message is being updated in this chat.
+"""
+
+UnknownOffice = """
+Unknown office. Use /register <office> with one of: {offices}
+"""
+
+Reminder = """
+Orders for {date} close soon and you have not chosen yet. Use /options to pick your lunch.
+"""
+
+ScheduledPublishSkipped = """
+Scheduled publish skipped: there is no draft. Use /draft and /add to prepare one.
+"""
+
+NothingToExport = """
+There is no closed menu to export.
+"""
+
+ExportUnavailable = """
+{format} export is not available on this server.
+"""
+
+Throttled = """
+Too many requests, try again in a moment.
+"""
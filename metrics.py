@@ -0,0 +1,172 @@
+import asyncio, bisect, contextvars, functools, logging, threading, time
+from collections import deque
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LatencyBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CountBuckets = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+Window = 2048
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=Window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, fraction: float) -> float:
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+lock = threading.Lock()
+histograms: Dict[Key, Histogram] = {}
+counters: Dict[Key, float] = {}
+gauges: Dict[Key, float] = {}
+# Queries issued on behalf of the update being handled, shared with executor threads.
+updateQueries: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("updateQueries", default=None)
+
+def key(name: str, labels: dict) -> Key:
+    return name, tuple(sorted(labels.items()))
+
+def observe(name: str, value: float, buckets: Tuple[float, ...] = LatencyBuckets, **labels) -> None:
+    with lock:
+        histogram = histograms.get(key(name, labels))
+        if not histogram:
+            histogram = histograms[key(name, labels)] = Histogram(buckets)
+        histogram.observe(value)
+
+def increment(name: str, amount: float = 1, **labels) -> None:
+    with lock:
+        counters[key(name, labels)] = counters.get(key(name, labels), 0) + amount
+
+def setGauge(name: str, value: float, **labels) -> None:
+    with lock:
+        gauges[key(name, labels)] = value
+
+@event.listens_for(Engine, "before_cursor_execute")
+def countQuery(connection, cursor, statement, parameters, context, executemany) -> None:
+    increment("db_queries_total")
+    queries = updateQueries.get()
+    if queries is not None:
+        queries[0] += 1
+
+def timed(operation: str, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            observe("db_seconds", time.perf_counter() - started, operation=operation)
+    return wrapper
+
+def instrumented(callback):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        queries = [0]
+        token = updateQueries.set(queries)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            updateQueries.reset(token)
+            observe("handler_seconds", time.perf_counter() - started, handler=callback.__name__)
+            observe("handler_db_queries", queries[0], CountBuckets, handler=callback.__name__)
+    return wrapper
+
+def instrument(handlers) -> None:
+    for handler in handlers:
+        if hasattr(handler, "entry_points"):
+            instrument(handler.entry_points)
+            for stateHandlers in handler.states.values():
+                instrument(stateHandlers)
+            instrument(handler.fallbacks)
+        else:
+            handler.callback = instrumented(handler.callback)
+
+def recordBroadcast(summary) -> None:
+    increment("broadcast_messages_total", summary.sent, result="sent")
+    increment("broadcast_messages_total", summary.failed, result="failed")
+    increment("broadcast_retries_total", summary.retried)
+    observe("broadcast_seconds", summary.elapsed, (1, 5, 10, 30, 60, 120, 300, 600))
+    if summary.elapsed:
+        setGauge("broadcast_messages_per_second", summary.sent / summary.elapsed)
+
+def summary() -> str:
+    with lock:
+        lines = []
+        for (name, labels), histogram in sorted(histograms.items()):
+            label = ",".join(labelValue for _, labelValue in labels)
+            scale, unit = (1000, "ms") if name.endswith("seconds") else (1, "")
+            lines.append(
+                f"{name}{'[' + label + ']' if label else ''}: n={histogram.count} "
+                f"p50={histogram.percentile(0.5) * scale:.1f}{unit} "
+                f"p95={histogram.percentile(0.95) * scale:.1f}{unit} "
+                f"p99={histogram.percentile(0.99) * scale:.1f}{unit}"
+            )
+        for (name, labels), value in sorted({**counters, **gauges}.items()):
+            label = ",".join(labelValue for _, labelValue in labels)
+            lines.append(f"{name}{'[' + label + ']' if label else ''}: {value:g}")
+    return '\n'.join(lines)
+
+def formatLabels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [f'{name}="{value}"' for name, value in (*labels, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def prometheus() -> str:
+    with lock:
+        lines, typed = [], set()
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE lunchbot_{name} histogram")
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                cumulative += count
+                lines.append(f"lunchbot_{name}_bucket{formatLabels(labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"lunchbot_{name}_sum{formatLabels(labels)} {histogram.sum}")
+            lines.append(f"lunchbot_{name}_count{formatLabels(labels)} {histogram.count}")
+        for metricType, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE lunchbot_{name} {metricType}")
+                lines.append(f"lunchbot_{name}{formatLabels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+async def serveRequest(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        requestLine = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        if requestLine.split(b" ")[1:2] == [b"/metrics"]:
+            status, body = "200 OK", prometheus().encode()
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def startServer(host: str, port: int) -> asyncio.AbstractServer:
+    logging.info("serving metrics on %s:%s", host, port)
+    return await asyncio.start_server(serveRequest, host, port)
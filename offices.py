@@ -0,0 +1,78 @@
+import contextvars, logging, os
+import asyncdb as db
+import config, database
+from contextlib import contextmanager
+from menucache import MenuCache
+from registry import UserRegistry
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    Optional
+)
+
+DefaultOffice = "default"
+
+class Office:
+    def __init__(self, name: str, directory: str, shard: Optional[db.Shard] = None):
+        self.name = name
+        self.directory = directory
+        self.shard = shard or db.Shard(name, database.Store(os.path.join(directory, database.DatabasePath)))
+        self.registry = UserRegistry(os.path.join(directory, "users.json"))
+        self.menuCache = MenuCache()
+
+offices: Dict[str, Office] = {}
+# A Telegram user belongs to one office; unknown users fall back to the first office.
+userOffices: Dict[int, Office] = {}
+activeOffice: contextvars.ContextVar[Optional[Office]] = contextvars.ContextVar("activeOffice", default=None)
+
+def activate(office: Office) -> tuple:
+    return activeOffice.set(office), db.activeShard.set(office.shard), database.activeStore.set(office.shard.store)
+
+@contextmanager
+def using(office: Office) -> Iterator[Office]:
+    officeToken, shardToken, storeToken = activate(office)
+    try:
+        yield office
+    finally:
+        database.activeStore.reset(storeToken)
+        db.activeShard.reset(shardToken)
+        activeOffice.reset(officeToken)
+
+def current() -> Office:
+    return activeOffice.get() or next(iter(offices.values()))
+
+def admit(office: Office, members: Iterable[database.Member]) -> None:
+    members = list(members)
+    office.registry.add(members)
+    for member in members:
+        userOffices.setdefault(member.id, office)
+
+def dismiss(office: Office, userIds: Iterable[int]) -> None:
+    userIds = list(userIds)
+    office.registry.remove(userIds)
+    for userId in userIds:
+        if userOffices.get(userId) is office:
+            del userOffices[userId]
+
+def route(userId: Optional[int], chosen: Optional[str] = None) -> Office:
+    return userOffices.get(userId) or offices.get(chosen) or next(iter(offices.values()))
+
+def load() -> None:
+    names = config.settings["offices"]
+    offices.clear()
+    userOffices.clear()
+    if names:
+        for name in names:
+            directory = os.path.join(config.settings["officesDirectory"], name)
+            os.makedirs(directory, exist_ok=True)
+            offices[name] = Office(name, directory)
+    else:
+        # Without configured offices the bot runs one office from the working directory.
+        offices[DefaultOffice] = Office(DefaultOffice, "", db.defaultShard)
+    for office in offices.values():
+        with using(office):
+            office.registry.load()
+        for userId in office.registry.roster.byId:
+            userOffices.setdefault(userId, office)
+    logging.info("serving %s offices", len(offices))
@@ -0,0 +1,103 @@
+import asyncio, logging, time
+from datetime import (
+    datetime,
+    timedelta,
+    timezone
+)
+import asyncdb as db
+import database
+from broadcast import (
+    Broadcaster,
+    DeliverySummary
+)
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple
+)
+
+# Chats claimed per round trip; at most this many end up unknown if the process dies mid batch.
+BatchSize = 64
+RetentionDays = 30
+
+class Outbox:
+    # Broadcasts are queued in the office database and sent by background tasks, so a
+    # restart picks up where the last process stopped instead of starting over.
+    def __init__(self, broadcaster: Broadcaster,
+                 onFinished: Optional[Callable[[int, DeliverySummary], Awaitable[None]]] = None, batchSize: int = BatchSize,
+                 retentionDays: float = RetentionDays):
+        self.broadcaster = broadcaster
+        self.onFinished = onFinished
+        self.batchSize = batchSize
+        self.retention = timedelta(days=retentionDays)
+        self.tasks: Dict[Tuple[str, int], asyncio.Task] = {}
+        self.stopping = False
+
+    def start(self, broadcastId: int) -> asyncio.Task:
+        key = (db.shard().name, broadcastId)
+        task = self.tasks.get(key)
+        if not task:
+            # The task keeps the caller's context, and with it the office the broadcast belongs to.
+            task = self.tasks[key] = asyncio.create_task(self.drain(broadcastId))
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        return task
+
+    async def enqueue(self, chatIds: Iterable[int], text: str) -> database.BroadcastProgress:
+        progress = await db.enqueueBroadcast(text, list(chatIds))
+        self.start(progress.id)
+        return progress
+
+    async def resume(self) -> List[int]:
+        # Batches claimed by drains already running in this process are still in flight.
+        running = [broadcastId for name, broadcastId in self.tasks if name == db.shard().name]
+        broadcastIds = await db.write(database.resumeBroadcasts, running)
+        for broadcastId in broadcastIds:
+            self.start(broadcastId)
+        return broadcastIds
+
+    async def drain(self, broadcastId: int) -> DeliverySummary:
+        summary = DeliverySummary()
+        started = time.monotonic()
+        try:
+            text = await db.read(database.broadcastText, broadcastId)
+            while text is not None and not self.stopping:
+                chatIds = await db.write(database.claimDeliveries, broadcastId, self.batchSize)
+                if not chatIds:
+                    break
+                batch = await self.broadcaster.broadcast(chatIds, text)
+                failed = set(batch.failedChats)
+                await db.write(database.finishDeliveries, broadcastId, [chatId for chatId in chatIds if chatId not in failed], batch.failedChats)
+                summary.sent += batch.sent
+                summary.failed += batch.failed
+                summary.retried += batch.retried
+                summary.failedChats.extend(batch.failedChats)
+        except Exception:
+            # Left unfinished in the database, so the next start resumes it.
+            logging.exception("broadcast %s stopped", broadcastId)
+            return summary
+        summary.elapsed = time.monotonic() - started
+        try:
+            await db.write(database.pruneBroadcasts, datetime.now(timezone.utc) - self.retention)
+        except Exception:
+            logging.exception("pruning old broadcasts failed")
+        if self.stopping:
+            logging.info("broadcast %s paused after %s messages", broadcastId, summary.total)
+        elif self.onFinished:
+            try:
+                await self.onFinished(broadcastId, summary)
+            except Exception:
+                logging.exception("broadcast %s finished but its summary failed", broadcastId)
+        return summary
+
+    async def idle(self) -> None:
+        while self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def stop(self) -> None:
+        # Batches already claimed are finished, everything else stays queued for the next start.
+        self.stopping = True
+        await self.idle()
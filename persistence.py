@@ -0,0 +1,153 @@
+import asyncio, json, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict,
+    Optional,
+    Tuple
+)
+from telegram.ext import (
+    BasePersistence,
+    PersistenceInput
+)
+
+StatePath = "state.db"
+
+class SqlitePersistence(BasePersistence):
+    # Conversation states and user data are kept; the bot has no chat or bot data of its own.
+    def __init__(self, path: str = StatePath, updateInterval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=updateInterval
+        )
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        self.staged: Dict[Tuple[str, str], Optional[str]] = {}
+        self.stagedUsers: Dict[int, Optional[str]] = {}
+        # Every update marks its user for saving; only data that actually changed is written.
+        self.savedUsers: Dict[int, str] = {}
+        self.writeTask: Optional[asyncio.Task] = None
+
+    def connect(self) -> sqlite3.Connection:
+        if not self.connection:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversation "
+                "(name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (name, key)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS userdata (userId INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+            )
+        return self.connection
+
+    def readConversations(self, name: str) -> dict:
+        rows = self.connect().execute("SELECT key, state FROM conversation WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    def readUserData(self) -> Dict[int, dict]:
+        rows = self.connect().execute("SELECT userId, data FROM userdata").fetchall()
+        return {userId: json.loads(data) for userId, data in rows}
+
+    def writeStates(self, states: Dict[Tuple[str, str], Optional[str]], users: Dict[int, Optional[str]]) -> None:
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO conversation (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, key) DO UPDATE SET state = excluded.state",
+                [(name, key, state) for (name, key), state in states.items() if state is not None]
+            )
+            connection.executemany(
+                "DELETE FROM conversation WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in states.items() if state is None]
+            )
+            connection.executemany(
+                "INSERT INTO userdata (userId, data) VALUES (?, ?) ON CONFLICT (userId) DO UPDATE SET data = excluded.data",
+                [(userId, data) for userId, data in users.items() if data is not None]
+            )
+            connection.executemany(
+                "DELETE FROM userdata WHERE userId = ?", [(userId,) for userId, data in users.items() if data is None]
+            )
+
+    async def writeStaged(self) -> None:
+        # Let the rest of this update_persistence round stage its states first.
+        await asyncio.sleep(0)
+        try:
+            while self.staged or self.stagedUsers:
+                states, self.staged = self.staged, {}
+                users, self.stagedUsers = self.stagedUsers, {}
+                await asyncio.get_running_loop().run_in_executor(self.executor, self.writeStates, states, users)
+        finally:
+            self.writeTask = None
+
+    async def get_conversations(self, name: str) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.readConversations, name)
+
+    def scheduleWrite(self) -> None:
+        if not self.writeTask:
+            self.writeTask = asyncio.create_task(self.writeStaged())
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self.staged[(name, json.dumps(list(key)))] = None if new_state is None else json.dumps(new_state)
+        self.scheduleWrite()
+
+    async def flush(self) -> None:
+        if (self.staged or self.stagedUsers) and not self.writeTask:
+            self.writeTask = asyncio.create_task(self.writeStaged())
+        if self.writeTask:
+            await self.writeTask
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+        self.executor.shutdown()
+
+    async def get_user_data(self) -> dict:
+        userData = await asyncio.get_running_loop().run_in_executor(self.executor, self.readUserData)
+        self.savedUsers = {userId: json.dumps(data) for userId, data in userData.items()}
+        return userData
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        # Users without data are not stored, so a vote spike writes nothing here.
+        encoded = json.dumps(data) if data else None
+        if encoded != self.savedUsers.get(user_id):
+            if encoded is None:
+                self.savedUsers.pop(user_id, None)
+            else:
+                self.savedUsers[user_id] = encoded
+            self.stagedUsers[user_id] = encoded
+            self.scheduleWrite()
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.update_user_data(user_id, {})
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
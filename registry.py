@@ -0,0 +1,82 @@
+import json, logging, os
+import database
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    NamedTuple,
+    Optional
+)
+
+class Roster(NamedTuple):
+    admin: dict
+    adminIds: FrozenSet[int]
+    byId: Dict[int, dict]
+    chatIds: FrozenSet[int]
+    # Display names are built once per roster instead of on every /status and /report.
+    names: Dict[int, str]
+
+def profile(member: database.Member) -> dict:
+    return {"id": member.id, "firstName": member.firstName, "lastName": member.lastName, "chatid": member.chatId}
+
+def displayName(user: dict) -> str:
+    return user["firstName"] + " " + user["lastName"]
+
+class UserRegistry:
+    def __init__(self, seedPath: str = "users.json"):
+        self.seedPath = seedPath
+        self.roster = Roster({}, frozenset(), {}, frozenset(), {})
+
+    def load(self) -> None:
+        if os.path.exists(self.seedPath):
+            # users.json only seeds the members table; approvals happen in the bot.
+            with open(self.seedPath, "r") as file:
+                data = json.load(file)
+            logging.info("imported %s users from %s", database.importMembers(data["admin"], data["users"]), self.seedPath)
+        members = database.approvedMembers()
+        byId = {member.id: profile(member) for member in members}
+        admins = [member for member in members if member.isAdmin]
+        self.roster = Roster(
+            profile(admins[0]) if admins else {}, frozenset(member.id for member in admins),
+            byId, frozenset(user["chatid"] for user in byId.values()),
+            {userId: displayName(user) for userId, user in byId.items()}
+        )
+
+    def add(self, members: Iterable[database.Member]) -> None:
+        added = {member.id: profile(member) for member in members}
+        if added:
+            # Swap the whole roster at once so handlers never see a half built index.
+            self.roster = self.roster._replace(
+                byId={**self.roster.byId, **added},
+                chatIds=self.roster.chatIds | {user["chatid"] for user in added.values()},
+                names={**self.roster.names, **{userId: displayName(user) for userId, user in added.items()}}
+            )
+
+    def remove(self, userIds: Iterable[int]) -> None:
+        removed = set(userIds) & self.roster.byId.keys()
+        if removed:
+            byId = {userId: user for userId, user in self.roster.byId.items() if userId not in removed}
+            self.roster = self.roster._replace(
+                byId=byId,
+                chatIds=frozenset(user["chatid"] for user in byId.values()),
+                names={userId: name for userId, name in self.roster.names.items() if userId not in removed}
+            )
+
+    @property
+    def admin(self) -> dict:
+        return self.roster.admin
+
+    def isAdmin(self, userId: int) -> bool:
+        return userId in self.roster.adminIds
+
+    def isUser(self, userId: int) -> bool:
+        return userId in self.roster.byId
+
+    def get(self, userId: int) -> Optional[dict]:
+        return self.roster.byId.get(userId)
+
+    def name(self, userId: int) -> str:
+        return self.roster.names.get(userId) or str(userId)
+
+    def chatIds(self) -> FrozenSet[int]:
+        return self.roster.chatIds
@@ -0,0 +1,55 @@
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+from database import OptionTally
+
+class VoteTally:
+    def __init__(self):
+        self.generation: Optional[int] = None
+        self.descriptions: Dict[int, str] = {}
+        self.voters: Dict[int, Set[int]] = {}
+        self.choices: Dict[int, Optional[int]] = {}
+        self.rebuilding = False
+        self.replay: List[Tuple[int, int, Optional[int]]] = []
+
+    def startRebuild(self) -> None:
+        self.rebuilding = True
+        self.replay = []
+
+    def rebuild(self, generation: Optional[int], rows: List[OptionTally]) -> None:
+        self.generation = generation
+        self.descriptions = {row.id: row.description for row in rows}
+        self.voters = {row.id: set(row.userIds) for row in rows}
+        self.choices = {userId: row.id for row in rows for userId in row.userIds}
+        self.rebuilding = False
+        # Votes committed while the snapshot was being read; applying them twice is harmless.
+        for vote in self.replay:
+            self.record(*vote)
+        self.replay = []
+
+    def record(self, generation: int, userId: int, optionId: Optional[int]) -> None:
+        if self.rebuilding:
+            self.replay.append((generation, userId, optionId))
+            return
+        if generation != self.generation:
+            return
+        previous = self.choices.get(userId)
+        if previous in self.voters:
+            self.voters[previous].discard(userId)
+        if optionId in self.voters:
+            self.voters[optionId].add(userId)
+        self.choices[userId] = optionId
+
+    @property
+    def ready(self) -> bool:
+        return self.generation is not None and not self.rebuilding
+
+    def rows(self) -> List[OptionTally]:
+        return [
+            OptionTally(optionId, description, len(self.voters[optionId]), list(self.voters[optionId]))
+            for optionId, description in self.descriptions.items()
+        ]
@@ -0,0 +1,23 @@
+import csv, io
+from datetime import date
+import export
+
+Rows = [(date(2026, 10, 19), 1, "Pizza"), (date(2026, 10, 19), 2, None)]
+
+def uploaded(fileFormat: str, filename: str):
+    upload = export.upload(export.document(Rows, lambda userId: f"User {userId}", fileFormat), filename)
+    with upload.input_file_content as file:
+        return upload, file.read()
+
+def test_small_csv_export_uploads():
+    upload, content = uploaded("csv", "orders.csv")
+    assert upload.filename == "orders.csv"
+    assert upload.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(content.decode("utf-8-sig"))))
+    assert rows == [list(export.Header), ["2026-10-19", "1", "User 1", "Pizza"], ["2026-10-19", "2", "User 2", ""]]
+
+def test_small_xlsx_export_uploads():
+    upload, content = uploaded("xlsx", "orders.xlsx")
+    assert upload.filename == "orders.xlsx"
+    assert upload.mimetype == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    assert content.startswith(b"PK")
@@ -0,0 +1,82 @@
+import asyncio, logging, metrics
+from broadcast import TokenBucket
+from typing import (
+    Coroutine,
+    Dict,
+    Optional,
+    Set
+)
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+MinPruneSize = 1024
+
+class UserBuckets:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.pruneAt = MinPruneSize
+
+    def allow(self, userId: int) -> bool:
+        bucket = self.buckets.get(userId)
+        if not bucket:
+            if len(self.buckets) >= self.pruneAt:
+                self.prune()
+            bucket = self.buckets[userId] = TokenBucket(self.rate, self.burst)
+        return bucket.tryAcquire()
+
+    def prune(self) -> None:
+        # A full bucket behaves exactly like a new one, so it can be dropped.
+        for userId, bucket in list(self.buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[userId]
+        self.pruneAt = max(MinPruneSize, 2 * len(self.buckets))
+
+class FloodControl(BaseUpdateProcessor):
+    # Throttled updates are dropped before they reach any handler; they hold a concurrency
+    # slot only for the bucket lookup.
+    def __init__(self, maxConcurrentUpdates: int, rate: float, burst: float, registerInterval: float, notice: str = ""):
+        super().__init__(maxConcurrentUpdates)
+        self.users = UserBuckets(rate, burst)
+        self.registrations = UserBuckets(1 / registerInterval, 1)
+        self.notice = notice
+        self.answers: Set[asyncio.Task] = set()
+
+    def reject(self, update: object) -> Optional[str]:
+        if not isinstance(update, Update) or not update.effective_user:
+            return None
+        userId = update.effective_user.id
+        if not self.users.allow(userId):
+            return "user"
+        if update.message and update.message.text and update.message.text.startswith("/register"):
+            if not self.registrations.allow(userId):
+                return "register"
+        return None
+
+    async def answer(self, update: Update) -> None:
+        try:
+            await update.callback_query.answer(self.notice)
+        except TelegramError as error:
+            logging.debug("answering a throttled query failed: %s", error)
+
+    async def do_process_update(self, update: object, coroutine: Coroutine) -> None:
+        reason = self.reject(update)
+        if not reason:
+            await coroutine
+            return
+        coroutine.close()
+        metrics.increment("throttled_updates_total", reason=reason)
+        if update.callback_query:
+            # Otherwise the pressed button keeps spinning until Telegram gives up on it.
+            task = asyncio.create_task(self.answer(update))
+            self.answers.add(task)
+            task.add_done_callback(self.answers.discard)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
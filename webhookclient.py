@@ -0,0 +1,54 @@
+import argparse, asyncio, itertools, statistics, time
+import httpx
+
+FirstUserId = 10_000_000
+updateIds = itertools.count(int(time.time()))
+
+def makeUpdate(userId: int, text: str) -> dict:
+    updateId = next(updateIds)
+    message = {
+        "message_id": updateId,
+        "date": int(time.time()),
+        "chat": {"id": userId, "type": "private"},
+        "from": {"id": userId, "is_bot": False, "first_name": "Webhook"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": updateId, "message": message}
+
+async def post(client: httpx.AsyncClient, args, userId: int, latencies: list, statuses: dict) -> None:
+    started = time.perf_counter()
+    response = await client.post(
+        args.url, json=makeUpdate(userId, args.text),
+        headers={"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    )
+    latencies.append(time.perf_counter() - started)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+async def run(args) -> None:
+    latencies, statuses = [], {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            post(client, args, FirstUserId + index % args.users, latencies, statuses)
+            for index in range(args.users * args.repeat)
+        ])
+        elapsed = time.perf_counter() - started
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(f"{len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), statuses {statuses}")
+    print(f"p50 {quantiles[49] * 1e3:.1f}ms, p95 {quantiles[94] * 1e3:.1f}ms, p99 {quantiles[98] * 1e3:.1f}ms")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Post synthetic updates to a LunchBot webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/lunchbot")
+    parser.add_argument("--secret", help="webhookSecret from config.json")
+    parser.add_argument("--text", default="/help")
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()